@@ -6,21 +6,32 @@ Optimized with lazy loading for Render (2GB RAM plan)
 """
 
 import os
-import io
 import base64
 import tempfile
-import shutil
 import asyncio
 import gc
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 import torch
-import torchaudio as ta
+
+from voice_conditioning import ConditioningCache, VoiceRegistry, fingerprint_audio
+from tts_scheduler import MicroBatchScheduler, QueueFullError, SynthesisJob
+from tts_streaming import split_sentences, to_pcm16, wav_stream_header
+from tts_audio import (
+    AudioFormatError, SynthesisResult, encode_audio, normalize_format,
+    resolve_bitrate, uncompressed_size, wants_binary
+)
+from tts_cache import AudioCache, audio_cache_key
+from memory_manager import MemoryManager
 
 # CRITICAL FIX: Patch torch.load to always use CPU mapping
 # This fixes "Attempting to deserialize object on a CUDA device" error
@@ -38,6 +49,44 @@ print("🔧 Applied CPU-safe torch.load patch for local development")
 model = None
 model_loading = False
 model_load_time = None
+model_load_error = None
+model_load_phases = {}
+_model_load_task = None
+default_conds = None  # Built-in voice conditionals, restored for requests without a clip
+
+# ChatterboxTTS keeps the active voice on the model instance, so conditioning
+# and generation must not interleave across threads
+model_lock = threading.Lock()
+
+# Dedicated threads for model work so the event loop stays free for /health and /
+TTS_INFERENCE_WORKERS = int(os.environ.get("TTS_INFERENCE_WORKERS", "1"))
+inference_executor = ThreadPoolExecutor(
+    max_workers=TTS_INFERENCE_WORKERS,
+    thread_name_prefix="tts-inference"
+)
+
+# Separate pool for audio encoding so codecs never hold up the next batch
+encoder_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TTS_ENCODER_WORKERS", "2")),
+    thread_name_prefix="tts-encoder"
+)
+
+# Prepared speaker conditionals keyed by reference clip hash
+conds_cache = ConditioningCache(max_entries=int(os.environ.get("TTS_CONDS_CACHE_SIZE", "32")))
+
+# Registered voice profiles, persisted across restarts
+voice_registry = VoiceRegistry(os.environ.get("VOICE_REGISTRY_DIR", "./voices"))
+
+# Collect only under memory pressure instead of on every request. The RSS
+# threshold defaults to TTS_GC_RSS_HEADROOM_MB above the RSS measured once the
+# model is loaded; TTS_GC_RSS_MB sets an absolute threshold instead
+memory_manager = MemoryManager(
+    rss_threshold_mb=float(os.environ["TTS_GC_RSS_MB"]) if os.environ.get("TTS_GC_RSS_MB") else None,
+    rss_headroom_mb=float(os.environ.get("TTS_GC_RSS_HEADROOM_MB", "512")),
+    rss_growth_mb=float(os.environ.get("TTS_GC_RSS_GROWTH_MB", "256")),
+    cuda_slack_mb=float(os.environ.get("TTS_CUDA_CACHE_SLACK_MB", "512")),
+    min_interval_s=float(os.environ.get("TTS_GC_MIN_INTERVAL_S", "5"))
+)
 
 # Set environment for better compatibility
 os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'
@@ -56,78 +105,165 @@ def get_device():
         print("🖥️  Using CPU for inference")
         return "cpu"
 
-async def load_model_async():
+# Checkpoint files fetched by ChatterboxTTS.from_pretrained
+CHATTERBOX_FILES = ["ve.safetensors", "t3_cfg.safetensors", "s3gen.safetensors", "tokenizer.json", "conds.pt"]
+# Warmup synthesis after loading; on by default only with TTS_EAGER_LOAD=1, so
+# a lazy load on the first request does not pay for an extra synthesis
+TTS_WARMUP = os.environ.get("TTS_WARMUP", os.environ.get("TTS_EAGER_LOAD", "0")) == "1"
+
+def _load_model_blocking(device: str, phases: dict):
     """
-    🔥 LAZY LOADING: Load the ChatterboxTTS model only when first needed
-    This prevents startup crashes and lets the server bind to port immediately
+    Load ChatterboxTTS in timed phases: import, download, weight load, warmup
+    Runs on the inference executor; phase timings are written into `phases`
     """
-    global model, model_loading, model_load_time
+    phase_start = time.perf_counter()
+    from chatterbox.tts import ChatterboxTTS
+    phases["import"] = round(time.perf_counter() - phase_start, 2)
+    print(f"   📦 import: {phases['import']:.2f}s")
     
-    # If model already loaded, return immediately
-    if model is not None:
-        return True
+    phase_start = time.perf_counter()
+    try:
+        from pathlib import Path
+        from huggingface_hub import hf_hub_download
+        from chatterbox.tts import REPO_ID
         
-    # If another request is already loading, wait for it
-    if model_loading:
-        print("⏳ Model already loading, waiting...")
-        while model_loading and model is None:
-            await asyncio.sleep(0.1)
-        return model is not None
+        for filename in CHATTERBOX_FILES:
+            local_path = hf_hub_download(repo_id=REPO_ID, filename=filename)
+        checkpoint_dir = Path(local_path).parent
+        phases["download"] = round(time.perf_counter() - phase_start, 2)
+        print(f"   ⬇️  download: {phases['download']:.2f}s")
+        
+        phase_start = time.perf_counter()
+        loaded = ChatterboxTTS.from_local(checkpoint_dir, device)
+    except Exception as e:
+        # Checkpoint layout differs in this chatterbox version - let it fetch its own files
+        print(f"   ⚠️  Phased download unavailable ({e}), using from_pretrained")
+        phases.pop("download", None)
+        phase_start = time.perf_counter()
+        loaded = ChatterboxTTS.from_pretrained(device=device)
+    phases["weights"] = round(time.perf_counter() - phase_start, 2)
+    print(f"   🏋️  weight load: {phases['weights']:.2f}s")
+    
+    if TTS_WARMUP:
+        phase_start = time.perf_counter()
+        with torch.inference_mode():
+            loaded.generate("Warm up.")
+        phases["warmup"] = round(time.perf_counter() - phase_start, 2)
+        print(f"   🔥 warmup inference: {phases['warmup']:.2f}s")
+    
+    return loaded
+
+async def _load_model():
+    """Single shared load; every waiter awaits this task"""
+    global model, model_loading, model_load_time, model_load_error, model_load_phases, default_conds
     
-    # Start loading process
     model_loading = True
+    model_load_error = None
+    model_load_phases = {}
     start_time = time.time()
     
     try:
-        print("📦 LAZY LOADING: Loading ChatterboxTTS model on first request...")
-        from chatterbox.tts import ChatterboxTTS
-        
+        print("📦 LAZY LOADING: Loading ChatterboxTTS model...")
         device = get_device()
         print(f"🚀 Loading model on device: {device}")
         
         # Force garbage collection before loading
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        memory_manager.collect("before_model_load")
         
         # Load model - the global torch.load patch handles CPU mapping automatically
-        model = ChatterboxTTS.from_pretrained(device=device)
+        # Runs on the inference executor so health checks keep answering meanwhile
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(
+            inference_executor, _load_model_blocking, device, model_load_phases
+        )
+        default_conds = loaded.conds
+        model = loaded
         
-        # Force garbage collection after loading
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        # Force garbage collection after loading, then move the model's objects
+        # to the permanent generation so later collections don't rescan them
+        memory_manager.collect("after_model_load")
+        gc.freeze()
+        rss_threshold = memory_manager.set_baseline()
+        print(f"🧹 GC threshold: {rss_threshold / (1024 * 1024):.0f} MB RSS "
+              f"(baseline {memory_manager.rss_baseline / (1024 * 1024):.0f} MB)")
         
         model_load_time = time.time() - start_time
         print(f"✅ ChatterboxTTS model loaded successfully in {model_load_time:.2f}s!")
-        model_loading = False
-        return True
         
     except Exception as e:
         print(f"❌ Error loading ChatterboxTTS model: {e}")
-        model_loading = False
         model_load_time = None
+        model_load_error = str(e)
+        raise
+    finally:
+        model_loading = False
+
+async def load_model_async():
+    """
+    🔥 LAZY LOADING: Load the ChatterboxTTS model only when first needed
+    This prevents startup crashes and lets the server bind to port immediately.
+    Concurrent callers share one load task and resume as soon as it finishes;
+    a failed load is reported to every waiter and retried by the next call.
+    """
+    global _model_load_task
+    
+    # If model already loaded, return immediately
+    if model is not None:
+        return True
+    
+    if _model_load_task is None or _model_load_task.done():
+        _model_load_task = asyncio.get_running_loop().create_task(_load_model())
+    else:
+        print("⏳ Model already loading, waiting...")
+    
+    try:
+        # Shielded so a disconnecting client doesn't cancel the shared load
+        await asyncio.shield(_model_load_task)
+        return True
+    except Exception:
         return False
 
+def _model_load_failure_detail() -> str:
+    if model_load_error:
+        return f"Failed to load TTS model: {model_load_error}"
+    return "Failed to load TTS model"
+
+async def _eager_load():
+    """Background load shortly after startup so the port is bound first"""
+    await asyncio.sleep(float(os.environ.get("TTS_EAGER_LOAD_DELAY_S", "0.5")))
+    print("🔥 EAGER LOADING: Loading model in the background...")
+    await load_model_async()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    🎯 LAZY LOADING LIFESPAN: Don't load model here!
-    This ensures fast startup and immediate port binding
+    🎯 LAZY LOADING LIFESPAN: Don't block on the model here!
+    This ensures fast startup and immediate port binding.
+    With TTS_EAGER_LOAD=1 loading starts in the background instead.
     """
     print("🚀 Starting Chatterbox TTS API Server...")
-    print("📝 LAZY LOADING: Model will load on first TTS request")
+    eager_task = None
+    if os.environ.get("TTS_EAGER_LOAD", "0") == "1":
+        print("📝 EAGER LOADING: Model will load in the background right after startup")
+        eager_task = asyncio.get_running_loop().create_task(_eager_load())
+    else:
+        print("📝 LAZY LOADING: Model will load on first TTS request")
     print("🏥 Server will be healthy immediately for Render detection")
     yield
+    if eager_task is not None and not eager_task.done():
+        eager_task.cancel()
     # Shutdown cleanup
     print("👋 Shutting down Chatterbox TTS API Server...")
+    await tts_scheduler.stop()
+    inference_executor.shutdown(wait=False)
+    encoder_executor.shutdown(wait=False)
     global model
     if model is not None:
         print("🧹 Cleaning up model from memory...")
+        conds_cache.clear()
         del model
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        gc.unfreeze()
+        memory_manager.collect("shutdown")
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -162,11 +298,17 @@ class TTSRequest(BaseModel):
     temperature: float = 0.8
     cfg_weight: float = 0.5
     seed: int = 0
+    voice_id: Optional[str] = None  # Registered voice from POST /voices
+    format: str = "wav"  # wav, flac, mp3 or opus
+    bitrate: Optional[int] = None  # kbps, for mp3/opus
 
 class TTSResponse(BaseModel):
     audio_base64: str
     sample_rate: int
     message: str
+    format: str = "wav"
+    audio_bytes: Optional[int] = None
+    bytes_saved: Optional[int] = None
 
 @app.get("/")
 async def root():
@@ -176,6 +318,8 @@ async def root():
         "model_loaded": model is not None,
         "model_loading": model_loading,
         "model_load_time": f"{model_load_time:.2f}s" if model_load_time else "N/A",
+        "model_load_phases": model_load_phases,
+        "model_load_error": model_load_error,
         "device": get_device() if model is not None else "TBD",
         "optimization": "lazy-loaded for 2GB RAM plan",
         "status": "🟢 Ready for requests"
@@ -188,9 +332,11 @@ async def health_check():
         "status": "healthy",
         "model_loaded": model is not None,
         "model_loading": model_loading,
+        "model_load_error": model_load_error,
         "device": get_device() if model is not None else "TBD",
         "torch_version": torch.__version__,
-        "lazy_loading": "✅ enabled"
+        "lazy_loading": "✅ enabled",
+        "tts_queue": f"{tts_scheduler.stats()['admitted']}/{tts_scheduler.max_queue}"
     }
 
 @app.post("/warm-up")
@@ -204,47 +350,333 @@ async def warm_up():
         return {
             "message": "🔥 Model warmed up successfully!",
             "device": get_device(),
-            "load_time": f"{model_load_time:.2f}s"
+            "load_time": f"{model_load_time:.2f}s" if model_load_time else "N/A",
+            "load_phases": model_load_phases
         }
     else:
-        raise HTTPException(status_code=500, detail="Failed to warm up model")
+        raise HTTPException(status_code=500, detail=_model_load_failure_detail())
+
+# Binary responses are documented alongside the legacy JSON body
+AUDIO_RESPONSES = {200: {
+    "content": {"audio/wav": {}, "audio/flac": {}, "audio/mpeg": {}, "audio/ogg": {}},
+    "description": "Audio bytes or base64 JSON"
+}}
+
+def _tts_response(result: SynthesisResult, http_request: Request, response_format: Optional[str] = None):
+    """
+    📦 Content negotiation: raw audio for clients that ask for it
+    (Accept: audio/* or response_format=binary), base64 JSON for legacy clients
+    """
+    if wants_binary(http_request.headers.get("accept"), response_format):
+        return Response(content=result.audio_bytes, media_type=result.media_type, headers=result.headers())
+    
+    return TTSResponse(
+        audio_base64=base64.b64encode(result.audio_bytes).decode('ascii'),
+        sample_rate=result.sample_rate,
+        message=result.message,
+        format=result.format,
+        audio_bytes=len(result.audio_bytes),
+        bytes_saved=result.bytes_saved
+    )
 
-@app.post("/tts", response_model=TTSResponse)
-async def generate_tts(request: TTSRequest):
+@app.post("/tts", response_model=TTSResponse, responses=AUDIO_RESPONSES)
+async def generate_tts(request: TTSRequest, http_request: Request, response_format: Optional[str] = None):
     """
     🗣️ Generate TTS audio from text (JSON API)
     First call will trigger lazy loading
     """
-    return await _generate_tts_internal(
+    result = await _generate_tts_internal(
         text=request.text,
         exaggeration=request.exaggeration,
         temperature=request.temperature,
         cfg_weight=request.cfg_weight,
         seed=request.seed,
-        audio_file=None
+        audio_file=None,
+        voice_id=request.voice_id,
+        audio_format=request.format,
+        bitrate=request.bitrate
     )
+    return _tts_response(result, http_request, response_format)
 
-@app.post("/tts-with-voice", response_model=TTSResponse)
+@app.post("/tts-with-voice", response_model=TTSResponse, responses=AUDIO_RESPONSES)
 async def generate_tts_with_voice(
+    http_request: Request,
     text: str = Form(...),
     exaggeration: float = Form(0.5),
     temperature: float = Form(0.8),
     cfg_weight: float = Form(0.5),
     seed: int = Form(0),
-    audio_file: Optional[UploadFile] = File(None)
+    audio_file: Optional[UploadFile] = File(None),
+    voice_id: Optional[str] = Form(None),
+    response_format: Optional[str] = Form(None),
+    format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
 ):
     """
     🎭 Generate TTS audio with optional voice cloning (Form API)
     First call will trigger lazy loading
     """
-    return await _generate_tts_internal(
+    result = await _generate_tts_internal(
         text=text,
         exaggeration=exaggeration,
         temperature=temperature,
         cfg_weight=cfg_weight,
         seed=seed,
-        audio_file=audio_file
+        audio_file=audio_file,
+        voice_id=voice_id,
+        audio_format=format,
+        bitrate=bitrate
     )
+    return _tts_response(result, http_request, response_format)
+
+def _resolve_stream_format(body_format: Optional[str], query_format: Optional[str]) -> str:
+    """
+    Stream format from the request body's `format`, or the older ?format=
+    query parameter; conflicting values are rejected rather than guessed
+    """
+    body_format = body_format.lower() if body_format else None
+    query_format = query_format.lower() if query_format else None
+    if query_format and body_format not in (None, "wav", query_format):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Conflicting formats: body '{body_format}', query '{query_format}'"
+        )
+    stream_format = query_format or body_format or "wav"
+    if stream_format not in ("wav", "pcm"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Streaming supports format 'wav' or 'pcm', not '{stream_format}'"
+        )
+    return stream_format
+
+@app.post("/tts-stream")
+async def generate_tts_stream(request: TTSRequest, format: Optional[str] = None):
+    """
+    🌊 Stream TTS audio sentence by sentence (chunked HTTP)
+    Body format=wav sends a streaming WAV header then PCM; format=pcm sends raw 16-bit PCM
+    (compressed formats are not streamed and get a 400)
+    """
+    stream_format = _resolve_stream_format(request.format, format)
+    return await _stream_tts_internal(
+        text=request.text,
+        exaggeration=request.exaggeration,
+        temperature=request.temperature,
+        cfg_weight=request.cfg_weight,
+        seed=request.seed,
+        voice_id=request.voice_id,
+        stream_format=stream_format
+    )
+
+@app.post("/voices")
+async def register_voice(
+    audio_file: UploadFile = File(...),
+    name: Optional[str] = Form(None)
+):
+    """
+    🎙️ Register a reference clip once and get a reusable voice_id
+    Conditioning is computed here and stored on disk
+    """
+    return await _register_voice_internal(audio_file=audio_file, name=name)
+
+@app.get("/voices")
+async def list_voices():
+    """List registered voice profiles"""
+    return {"voices": voice_registry.list()}
+
+@app.delete("/voices/{voice_id}")
+async def delete_voice(voice_id: str):
+    """Remove a registered voice profile"""
+    if not voice_registry.delete(voice_id):
+        raise HTTPException(status_code=404, detail=f"Unknown voice_id: {voice_id}")
+    # Otherwise the cached conditionals would keep the voice usable until evicted
+    conds_cache.discard(voice_id)
+    return {"message": f"Voice {voice_id} deleted"}
+
+async def _read_reference_clip(audio_file: UploadFile) -> bytes:
+    """Validate an uploaded reference clip and return its bytes"""
+    print(f"🎵 Processing uploaded audio file: {audio_file.filename}")
+    
+    # Increased limit for 2GB RAM plan
+    if audio_file.size > 15 * 1024 * 1024:  # 15MB limit
+        raise HTTPException(status_code=400, detail="Audio file too large (max 15MB)")
+    
+    # Check file extension
+    allowed_extensions = ['.wav', '.mp3', '.flac', '.m4a', '.ogg']
+    if not audio_file.filename or not any(audio_file.filename.lower().endswith(ext) for ext in allowed_extensions):
+        raise HTTPException(status_code=400, detail="Unsupported audio format")
+    
+    return await audio_file.read()
+
+def _prepare_clip_conds(audio_bytes: bytes, voice_key: str, exaggeration: float = 0.5):
+    """Run the reference-audio pipeline for a clip and cache the result"""
+    audio_prompt_path = None
+    try:
+        # Save uploaded file temporarily
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
+            tmp_file.write(audio_bytes)
+            audio_prompt_path = tmp_file.name
+            print(f"💾 Saved audio file to: {audio_prompt_path}")
+        with torch.inference_mode():
+            model.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
+        conds_cache.put(voice_key, model.conds)
+        return model.conds
+    finally:
+        # Clean up temporary file
+        if audio_prompt_path and os.path.exists(audio_prompt_path):
+            try:
+                os.unlink(audio_prompt_path)
+                print(f"🧹 Cleaned up temporary file: {audio_prompt_path}")
+            except Exception as e:
+                print(f"⚠️  Warning: Could not delete temporary file: {e}")
+
+def _resolve_voice_conds(voice_key: Optional[str], audio_bytes: Optional[bytes], exaggeration: float):
+    """Find conditionals for a voice: memory cache, registry on disk, or a fresh clip"""
+    if not voice_key:
+        return default_conds
+    
+    cached_conds = conds_cache.get(voice_key)
+    if cached_conds is not None:
+        print(f"⚡ Reusing cached voice conditionals: {voice_key[:8]}")
+        return cached_conds
+    
+    stored_conds = voice_registry.load(voice_key, device=get_device())
+    if stored_conds is not None:
+        print(f"📂 Loaded registered voice: {voice_key[:8]}")
+        conds_cache.put(voice_key, stored_conds)
+        return stored_conds
+    
+    if audio_bytes is None:
+        raise HTTPException(status_code=404, detail=f"Unknown voice_id: {voice_key}")
+    return _prepare_clip_conds(audio_bytes, voice_key, exaggeration)
+
+async def _register_voice_internal(audio_file: UploadFile, name: Optional[str] = None):
+    """
+    🎙️ Prepare and persist conditionals for a reference clip
+    Registering the same clip twice returns the existing voice_id
+    """
+    if not audio_file or not audio_file.size:
+        raise HTTPException(status_code=400, detail="Audio file cannot be empty")
+    
+    audio_bytes = await _read_reference_clip(audio_file)
+    voice_id = fingerprint_audio(audio_bytes)
+    
+    existing = voice_registry.info(voice_id)
+    if existing is not None:
+        return {**existing, "message": "Voice already registered"}
+    
+    if model is None:
+        success = await load_model_async()
+        if not success:
+            raise HTTPException(status_code=500, detail=_model_load_failure_detail())
+    
+    def _prepare_locked():
+        with model_lock:
+            return _prepare_clip_conds(audio_bytes, voice_id)
+    
+    try:
+        conds = await asyncio.get_running_loop().run_in_executor(inference_executor, _prepare_locked)
+        record = voice_registry.save(voice_id, conds, {
+            "name": name or audio_file.filename,
+            "source_filename": audio_file.filename,
+            "source_bytes": len(audio_bytes),
+        })
+    except Exception as e:
+        print(f"❌ Voice registration error: {e}")
+        raise HTTPException(status_code=500, detail=f"Voice registration failed: {str(e)}")
+    
+    print(f"✅ Registered voice {voice_id[:8]} ({record['profile_bytes']} bytes)")
+    return {**record, "message": "Voice registered successfully"}
+
+def _synthesize_batch(jobs):
+    """
+    🧮 Run one group of compatible jobs (same voice and sampling params)
+    Conditionals are set up once per group. Identical seeded requests are
+    deterministic, so they share a single generation. Models exposing
+    generate_batch() get the remaining texts in one forward pass; stock
+    ChatterboxTTS generates them back to back.
+    """
+    with model_lock:
+        results = _synthesize_group_locked(jobs)
+    
+    # Memory cleanup only when RSS/CUDA thresholds say it is worth it
+    memory_manager.maybe_collect("after_generation")
+    return results
+
+def _synthesize_group_locked(jobs):
+    first = jobs[0]
+    try:
+        voice_conds = _resolve_voice_conds(first.voice_key, first.audio_bytes, first.exaggeration)
+    except Exception as e:
+        return [e] * len(jobs)
+    if voice_conds is not None:
+        model.conds = voice_conds
+    
+    generate_args = {
+        "exaggeration": first.exaggeration,
+        "temperature": first.temperature,
+        "cfg_weight": first.cfg_weight,
+    }
+    
+    # Coalesce identical seeded requests
+    unique = {}
+    for index, job in enumerate(jobs):
+        dedupe_key = (job.text, job.seed) if job.seed != 0 else ("__unseeded__", index)
+        unique.setdefault(dedupe_key, []).append(index)
+    
+    results = [None] * len(jobs)
+    pending = list(unique.values())
+    
+    generate_batch = getattr(model, "generate_batch", None)
+    unseeded = [indices for indices in pending if jobs[indices[0]].seed == 0]
+    if generate_batch is not None and len(unseeded) > 1:
+        try:
+            with torch.inference_mode():
+                wavs = generate_batch(texts=[jobs[indices[0]].text for indices in unseeded], **generate_args)
+            for indices, wav in zip(unseeded, wavs):
+                for index in indices:
+                    results[index] = wav
+            pending = [indices for indices in pending if jobs[indices[0]].seed != 0]
+        except Exception as e:
+            print(f"⚠️  Batched generation failed, falling back to sequential: {e}")
+    
+    for indices in pending:
+        job = jobs[indices[0]]
+        try:
+            # Set seed if provided
+            if job.seed != 0:
+                torch.manual_seed(job.seed)
+            with torch.inference_mode():
+                wav = model.generate(text=job.text, **generate_args)
+        except Exception as e:
+            wav = e
+        for index in indices:
+            results[index] = wav
+    
+    return results
+
+# Queue that groups concurrent requests into batches
+tts_scheduler = MicroBatchScheduler(
+    run_batch=_synthesize_batch,
+    max_batch_size=int(os.environ.get("TTS_MAX_BATCH_SIZE", "4")),
+    max_wait_ms=float(os.environ.get("TTS_BATCH_WAIT_MS", "10")),
+    executor=inference_executor,
+    max_concurrency=TTS_INFERENCE_WORKERS,
+    max_queue=int(os.environ.get("TTS_MAX_QUEUE", "16"))
+)
+
+# Replay cache for seeded (deterministic) requests
+audio_cache = AudioCache(
+    directory=os.environ.get("TTS_AUDIO_CACHE_DIR", "./tts_cache"),
+    max_memory_bytes=int(float(os.environ.get("TTS_AUDIO_CACHE_MEMORY_MB", "64")) * 1024 * 1024),
+    max_disk_bytes=int(float(os.environ.get("TTS_AUDIO_CACHE_DISK_MB", "512")) * 1024 * 1024),
+    ttl_seconds=float(os.environ.get("TTS_AUDIO_CACHE_TTL", str(7 * 24 * 3600)))
+)
+TTS_AUDIO_CACHE_NAMESPACE = os.environ.get("TTS_AUDIO_CACHE_NAMESPACE", "chatterbox-v1")
+
+# Streaming endpoint limits
+TTS_STREAM_MAX_CHARS = int(os.environ.get("TTS_STREAM_MAX_CHARS", "5000"))
+TTS_STREAM_SEGMENT_CHARS = int(os.environ.get("TTS_STREAM_SEGMENT_CHARS", "300"))
+TTS_STREAM_LOOKAHEAD = int(os.environ.get("TTS_STREAM_LOOKAHEAD", "1"))
 
 async def _generate_tts_internal(
     text: str,
@@ -252,10 +684,14 @@ async def _generate_tts_internal(
     temperature: float,
     cfg_weight: float,
     seed: int,
-    audio_file: Optional[UploadFile]
+    audio_file: Optional[UploadFile],
+    voice_id: Optional[str] = None,
+    audio_format: str = "wav",
+    bitrate: Optional[int] = None
 ):
     """
     🎯 Internal TTS generation with lazy loading
+    Returns encoded audio; use _tts_response() to turn it into an HTTP response
     """
     global model
     
@@ -267,105 +703,204 @@ async def _generate_tts_internal(
     if len(text) > 500:
         raise HTTPException(status_code=400, detail="Text must be 500 characters or less")
     
+    try:
+        audio_format = normalize_format(audio_format)
+    except AudioFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    bitrate = resolve_bitrate(audio_format, bitrate)
+    
+    # Handle audio file upload for voice cloning
+    audio_bytes = None
+    voice_key = voice_id
+    if audio_file and audio_file.size > 0:
+        audio_bytes = await _read_reference_clip(audio_file)
+        voice_key = fingerprint_audio(audio_bytes)
+    elif voice_id and voice_id not in conds_cache and not voice_registry.exists(voice_id):
+        # Checked before the audio cache, so a deleted voice's cached audio is not served
+        raise HTTPException(status_code=404, detail=f"Unknown voice_id: {voice_id}")
+    
+    # ⚡ Seeded requests are deterministic - replay them without touching the model
+    cache_key = None
+    if seed != 0:
+        cache_key = audio_cache_key(
+            TTS_AUDIO_CACHE_NAMESPACE, text, voice_key, exaggeration,
+            temperature, cfg_weight, seed, audio_format, bitrate
+        )
+        cached = audio_cache.get(cache_key)
+        if cached is not None:
+            cached_audio, meta = cached
+            print(f"⚡ Serving cached audio: {cache_key[:8]}")
+            return SynthesisResult(
+                audio_bytes=cached_audio,
+                sample_rate=meta["sample_rate"],
+                media_type=meta["media_type"],
+                message=meta["message"] + " (cached)",
+                duration_seconds=meta["duration_seconds"],
+                format=audio_format,
+                bitrate_kbps=meta.get("bitrate_kbps"),
+                uncompressed_bytes=meta["uncompressed_bytes"]
+            )
+    
     # 🔥 LAZY LOADING: Load model only when first TTS request comes in
     if model is None:
         print("🔥 LAZY LOADING: First TTS request - loading model now...")
         success = await load_model_async()
         if not success:
-            raise HTTPException(status_code=500, detail="Failed to load TTS model")
+            raise HTTPException(status_code=500, detail=_model_load_failure_detail())
         print("✅ Model loaded, proceeding with TTS generation...")
     
-    audio_prompt_path = None
-    
     try:
-        # Memory optimization
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        
-        # Handle audio file upload for voice cloning
-        if audio_file and audio_file.size > 0:
-            print(f"🎵 Processing uploaded audio file: {audio_file.filename}")
-            
-            # Increased limit for 2GB RAM plan
-            if audio_file.size > 15 * 1024 * 1024:  # 15MB limit
-                raise HTTPException(status_code=400, detail="Audio file too large (max 15MB)")
-            
-            # Check file extension
-            allowed_extensions = ['.wav', '.mp3', '.flac', '.m4a', '.ogg']
-            if not any(audio_file.filename.lower().endswith(ext) for ext in allowed_extensions):
-                raise HTTPException(status_code=400, detail="Unsupported audio format")
-            
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                shutil.copyfileobj(audio_file.file, tmp_file)
-                audio_prompt_path = tmp_file.name
-                print(f"💾 Saved audio file to: {audio_prompt_path}")
-        
-        # Set seed if provided
-        if seed != 0:
-            torch.manual_seed(seed)
-        
-        # Generate audio using ChatterboxTTS
+        # Generate audio using ChatterboxTTS - queued so concurrent requests can share a batch
         print(f"🎤 Generating TTS for: {text}...")
+        try:
+            wav = await tts_scheduler.submit(SynthesisJob(
+                text=text,
+                exaggeration=exaggeration,
+                temperature=temperature,
+                cfg_weight=cfg_weight,
+                seed=seed,
+                voice_key=voice_key,
+                audio_bytes=audio_bytes
+            ))
+        except QueueFullError as e:
+            print(f"🚦 TTS queue full, rejecting request (retry in {e.retry_after}s)")
+            raise HTTPException(
+                status_code=503,
+                detail="TTS server is busy, please retry shortly",
+                headers={"Retry-After": str(e.retry_after)}
+            )
         
-        # Prepare generation arguments
-        generate_args = {
-            "text": text,
-            "exaggeration": exaggeration,
-            "temperature": temperature,
-            "cfg_weight": cfg_weight,
-        }
-        
-        # Add audio prompt if provided
-        if audio_prompt_path:
-            generate_args["audio_prompt_path"] = audio_prompt_path
-        
-        # Generate with memory optimization
-        with torch.inference_mode():
-            wav = model.generate(**generate_args)
-        
-        # Memory cleanup after generation
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        
-        # Convert to bytes
-        audio_buffer = io.BytesIO()
-        ta.save(audio_buffer, wav, model.sr, format="wav")
-        audio_bytes = audio_buffer.getvalue()
-        
-        # Encode to base64
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+        # Encode on the encoder pool, off the inference path
+        try:
+            encoded, media_type, bitrate_used = await asyncio.get_running_loop().run_in_executor(
+                encoder_executor, encode_audio, wav, model.sr, audio_format, bitrate
+            )
+        except AudioFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         print("✅ TTS generation successful!")
         
         device_info = get_device() if model is not None else "unknown"
         message = f"TTS generation successful ({device_info})"
-        if audio_prompt_path:
+        if voice_key:
             message += " with voice cloning"
         
-        return TTSResponse(
-            audio_base64=audio_base64,
+        result = SynthesisResult(
+            audio_bytes=encoded,
             sample_rate=model.sr,
-            message=message
+            media_type=media_type,
+            message=message,
+            duration_seconds=wav.shape[-1] / model.sr,
+            format=audio_format,
+            bitrate_kbps=bitrate_used,
+            uncompressed_bytes=uncompressed_size(wav)
         )
+        if audio_format != "wav":
+            print(f"🗜️  Encoded {audio_format}: {len(encoded)} bytes ({result.bytes_saved} bytes saved vs wav)")
+        
+        if cache_key is not None:
+            audio_cache.put(cache_key, encoded, {
+                "sample_rate": result.sample_rate,
+                "media_type": result.media_type,
+                "message": result.message,
+                "duration_seconds": result.duration_seconds,
+                "bitrate_kbps": result.bitrate_kbps,
+                "uncompressed_bytes": result.uncompressed_bytes
+            })
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ TTS generation error: {e}")
         raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
+
+async def _stream_tts_internal(
+    text: str,
+    exaggeration: float,
+    temperature: float,
+    cfg_weight: float,
+    seed: int,
+    voice_id: Optional[str] = None,
+    stream_format: str = "wav"
+):
+    """
+    🌊 Split text into sentences and stream each segment as soon as it is ready
+    The next segment(s) are already queued while the current one is sent
+    """
+    if not text or len(text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
     
-    finally:
-        # Clean up temporary file
-        if audio_prompt_path and os.path.exists(audio_prompt_path):
+    if len(text) > TTS_STREAM_MAX_CHARS:
+        raise HTTPException(status_code=400, detail=f"Text must be {TTS_STREAM_MAX_CHARS} characters or less")
+    
+    if stream_format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="format must be 'wav' or 'pcm'")
+    
+    if voice_id and voice_id not in conds_cache and not voice_registry.exists(voice_id):
+        raise HTTPException(status_code=404, detail=f"Unknown voice_id: {voice_id}")
+    
+    if model is None:
+        success = await load_model_async()
+        if not success:
+            raise HTTPException(status_code=500, detail=_model_load_failure_detail())
+    
+    if tts_scheduler.is_full():
+        retry_after = tts_scheduler.retry_after()
+        raise HTTPException(
+            status_code=503,
+            detail="TTS server is busy, please retry shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    segments = split_sentences(text, max_chars=TTS_STREAM_SEGMENT_CHARS)
+    print(f"🌊 Streaming TTS in {len(segments)} segments")
+    
+    async def _synthesize_segment(segment: str):
+        while True:
             try:
-                os.unlink(audio_prompt_path)
-                print(f"🧹 Cleaned up temporary file: {audio_prompt_path}")
-            except Exception as e:
-                print(f"⚠️  Warning: Could not delete temporary file: {e}")
-        
-        # Final memory cleanup
-        gc.collect()
+                return await tts_scheduler.submit(SynthesisJob(
+                    text=segment,
+                    exaggeration=exaggeration,
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    seed=seed,
+                    voice_key=voice_id
+                ))
+            except QueueFullError as e:
+                # The response has already started, so wait for room instead of failing
+                await asyncio.sleep(e.retry_after)
+    
+    async def _audio_chunks():
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        next_index = 0
+        try:
+            if stream_format == "wav":
+                yield wav_stream_header(model.sr)
+            while next_index < len(segments) or pending:
+                while next_index < len(segments) and len(pending) <= TTS_STREAM_LOOKAHEAD:
+                    pending.append(loop.create_task(_synthesize_segment(segments[next_index])))
+                    next_index += 1
+                wav = await pending.popleft()
+                yield to_pcm16(wav)
+        except Exception as e:
+            print(f"❌ Streaming TTS error: {e}")
+            raise
+        finally:
+            # Client disconnected or a segment failed - drop queued work
+            for task in pending:
+                task.cancel()
+    
+    media_type = "audio/wav" if stream_format == "wav" else f"audio/L16;rate={model.sr};channels=1"
+    return StreamingResponse(
+        _audio_chunks(),
+        media_type=media_type,
+        headers={
+            "X-Sample-Rate": str(model.sr),
+            "X-Segments": str(len(segments))
+        }
+    )
 
 @app.get("/models/info")
 async def model_info():
@@ -377,8 +912,15 @@ async def model_info():
             "loaded": False,
             "device": "TBD",
             "load_time": "N/A",
+            "loading": model_loading,
+            "load_phases": model_load_phases,
+            "load_error": model_load_error,
             "message": "🔥 Model not loaded yet - will lazy load on first TTS request",
-            "lazy_loading": "✅ enabled"
+            "lazy_loading": "✅ enabled",
+            "voice_cache": conds_cache.stats(),
+            "audio_cache": audio_cache.stats(),
+            "scheduler": tts_scheduler.stats(),
+            "memory": memory_manager.stats()
         }
     
     return {
@@ -386,8 +928,13 @@ async def model_info():
         "sample_rate": model.sr,
         "device": get_device(),
         "load_time": f"{model_load_time:.2f}s" if model_load_time else "N/A",
+        "load_phases": model_load_phases,
         "message": "🎤 ChatterboxTTS model is ready!",
-        "lazy_loading": "✅ enabled"
+        "lazy_loading": "✅ enabled",
+        "voice_cache": conds_cache.stats(),
+        "audio_cache": audio_cache.stats(),
+        "scheduler": tts_scheduler.stats(),
+        "memory": memory_manager.stats()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+"""
+Benchmark the vector backends (see vector_store.py) on the same corpus.
+
+Each backend gets a fresh store in a temporary directory, is loaded with
+the same vectors, and is queried with the same queries. Reported per
+backend: build time, single-query p50/p99 latency, batched latency per
+query, recall@k against exact float32 search, and size on disk. The
+quantized backends also report the recall of their candidates before
+rescoring.
+
+Usage:
+    python benchmark_vector_backends.py --n 50000 --dim 1024
+    python benchmark_vector_backends.py --from-collection --backends chroma flat int8
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from kb_config import KBConfig
+from vector_store import VECTOR_BACKENDS, open_vector_store
+
+ADD_BATCH = 1000
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Clustered unit vectors, so nearest neighbours are not all equally far"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = corpus[rng.choice(n, n_queries, replace=False)] + 0.1 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return _normalize(corpus), _normalize(queries)
+
+
+def collection_corpus(n_queries: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Stored embeddings of the configured collection; queries are a sample of them"""
+    store = open_vector_store()
+    corpus = np.asarray(store.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+    if len(corpus) == 0:
+        raise SystemExit(f"The {KBConfig.VECTOR_BACKEND} collection is empty")
+    rng = np.random.default_rng(seed)
+    queries = corpus[rng.choice(len(corpus), min(n_queries, len(corpus)), replace=False)]
+    return _normalize(corpus), _normalize(queries)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _disk_bytes(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(directory)
+        for name in files
+    )
+
+
+def benchmark_backend(backend: str, corpus: np.ndarray, queries: np.ndarray,
+                      truth: List[set], k: int) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+    try:
+        store = open_vector_store(backend, name="benchmark", chroma_directory=directory,
+                                  store_directory=directory)
+        ids = [str(i) for i in range(len(corpus))]
+
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), ADD_BATCH):
+            store.add(ids=ids[offset:offset + ADD_BATCH], embeddings=corpus[offset:offset + ADD_BATCH])
+        build_seconds = time.perf_counter() - start
+
+        # Warm up caches and memory maps before timing
+        store.query(query_embeddings=queries[:1], n_results=k, include=[])
+
+        latencies = []
+        hits = 0
+        for q, query in enumerate(queries):
+            start = time.perf_counter()
+            found = store.query(query_embeddings=query[None, :], n_results=k, include=[])["ids"][0]
+            latencies.append(time.perf_counter() - start)
+            hits += len(truth[q] & {int(doc_id) for doc_id in found})
+
+        start = time.perf_counter()
+        store.query(query_embeddings=queries, n_results=k, include=[])
+        batch_seconds = time.perf_counter() - start
+
+        latencies_ms = np.asarray(latencies) * 1000
+        result = {
+            "backend": backend,
+            "build_seconds": round(build_seconds, 2),
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+            "batched_ms_per_query": round(batch_seconds * 1000 / len(queries), 3),
+            "recall_at_k": round(hits / float(k * len(queries)), 4),
+            "disk_mb": round(_disk_bytes(directory) / 1e6, 1),
+        }
+        if hasattr(store, "candidates"):
+            # Recall of the quantized candidates before rescoring, also
+            # against the float32 truth (rows are in insertion order)
+            candidates = store.candidates(queries, k * store.rescore_factor, store._alive)
+            hits = sum(len(truth[q] & set(row.tolist())) for q, row in enumerate(candidates))
+            result["candidate_recall_at_k"] = round(hits / float(k * len(queries)), 4)
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector backends on the same corpus")
+    parser.add_argument("--backends", nargs="+", default=list(VECTOR_BACKENDS), choices=VECTOR_BACKENDS)
+    parser.add_argument("--n", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=KBConfig.EMBEDDING_DIMENSION)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=KBConfig.TOP_K_RESULTS)
+    parser.add_argument("--from-collection", action="store_true",
+                        help="Use the embeddings stored in the configured collection instead of synthetic data")
+    args = parser.parse_args()
+
+    if args.from_collection:
+        corpus, queries = collection_corpus(args.queries)
+    else:
+        corpus, queries = synthetic_corpus(args.n, args.dim, args.queries)
+    k = min(args.k, len(corpus))
+    # open_vector_store sizes the local stores from the configured dimension
+    KBConfig.EMBEDDING_DIMENSION = corpus.shape[1]
+
+    scores = queries @ corpus.T
+    truth = [set(row.tolist()) for row in np.argpartition(-scores, k - 1, axis=1)[:, :k]]
+    print(f"Corpus: {len(corpus)} x {corpus.shape[1]}, {len(queries)} queries, k={k}")
+
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(benchmark_backend(backend, corpus, queries, truth, k))
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        print(json.dumps(results[-1]))
+
+    if results:
+        print(f"\n{'backend':<8} {'build s':>8} {'p50 ms':>8} {'p99 ms':>8} {'batch ms/q':>11} {'recall':>7} {'disk MB':>8}")
+        for r in results:
+            print(f"{r['backend']:<8} {r['build_seconds']:>8} {r['p50_ms']:>8} {r['p99_ms']:>8} "
+                  f"{r['batched_ms_per_query']:>11} {r['recall_at_k']:>7} {r['disk_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
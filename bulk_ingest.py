@@ -0,0 +1,234 @@
+"""
+Bulk ingestion with a pool of embedding worker processes.
+
+Documents are cut into shards and encoded by several worker processes,
+each pinned to its own subset of cores with matching thread settings.
+Shards are written to Chroma in input order as they complete.
+
+Usage:
+    python bulk_ingest.py docs/ notes.txt --workers 4 --threads-per-worker 4
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from kb_config import KBConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of a worker; torch is only imported inside workers
+# after the thread environment has been set
+_worker_service = None
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_core_sets(workers: int, threads_per_worker: int) -> List[List[int]]:
+    """Give each worker a contiguous block of cores, wrapping if there are too few."""
+    cores = available_cores()
+    return [
+        [cores[(w * threads_per_worker + t) % len(cores)] for t in range(threads_per_worker)]
+        for w in range(workers)
+    ]
+
+
+def _init_worker(core_sets, threads_per_worker: int):
+    """Pin this worker to its cores, size its thread pools, then load the model."""
+    global _worker_service
+
+    cores = core_sets.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads_per_worker)
+    # Fast tokenizers spawn their own pool otherwise
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+
+    from stella_embeddings import StellaEmbeddingService
+    _worker_service = StellaEmbeddingService()
+    logging.getLogger(__name__).info(f"Embedding worker {os.getpid()} ready on cores {cores}")
+
+
+def _encode_shard(texts: List[str]) -> Tuple[Any, int, float]:
+    """Runs in a worker: returns (embeddings, token count, seconds)."""
+    start = time.perf_counter()
+    tokens = int(_worker_service._token_lengths(texts).sum())
+    embeddings = _worker_service.encode_documents(texts)
+    return embeddings, tokens, time.perf_counter() - start
+
+
+class EmbeddingWorkerPool:
+    """
+    Process pool of StellaEmbeddingService instances.
+    Each worker holds its own copy of the model, so size `workers`
+    to the available RAM as well as to the core count.
+    """
+
+    def __init__(self, workers: int = 2, threads_per_worker: Optional[int] = None):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or max(1, len(available_cores()) // self.workers)
+        self.core_sets = plan_core_sets(self.workers, self.threads_per_worker)
+
+        # spawn: forking a process that already holds torch/tokenizer threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        core_queue = context.Queue()
+        for cores in self.core_sets:
+            core_queue.put(cores)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(core_queue, self.threads_per_worker)
+        )
+
+    def encode_ordered(self, shards: Iterator[List[str]]) -> Iterator[Tuple[List[str], Any, int, float]]:
+        """
+        Encode shards in parallel and yield (texts, embeddings, tokens, seconds)
+        in input order. At most two shards per worker are in flight.
+        """
+        in_flight = deque()
+        for texts in shards:
+            in_flight.append((texts, self._executor.submit(_encode_shard, texts)))
+            if len(in_flight) >= self.workers * 2:
+                texts, future = in_flight.popleft()
+                yield (texts, *future.result())
+        while in_flight:
+            texts, future = in_flight.popleft()
+            yield (texts, *future.result())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def bulk_add_documents(vector_db,
+                       documents: List[str],
+                       metadatas: Optional[List[Dict]] = None,
+                       workers: int = 2,
+                       threads_per_worker: Optional[int] = None,
+                       shard_size: int = 64) -> Dict[str, Any]:
+    """
+    Encode `documents` on an EmbeddingWorkerPool and stream them into
+    `vector_db` in order. Chunks already in the collection are skipped
+    before encoding. Returns a throughput report.
+    """
+    all_ids, new_positions, metadatas = vector_db.plan_new_documents(documents, metadatas)
+    skipped = len(documents) - len(new_positions)
+    documents = [documents[i] for i in new_positions]
+    metadatas = [metadatas[i] for i in new_positions]
+    if not documents:
+        logger.info(f"Nothing to ingest, {skipped} duplicates skipped")
+        return {"documents": 0, "skipped_duplicates": skipped, "tokens": 0, "ids": all_ids,
+                "workers": 0, "threads_per_worker": 0, "seconds": 0.0, "worker_encode_seconds": 0.0,
+                "docs_per_second": 0.0, "tokens_per_second": 0.0}
+
+    shards = (documents[i:i + shard_size] for i in range(0, len(documents), shard_size))
+    start = time.perf_counter()
+    total_tokens = 0
+    encode_seconds = 0.0
+    offset = 0
+
+    with EmbeddingWorkerPool(workers, threads_per_worker) as pool:
+        logger.info(
+            f"Bulk ingesting {len(documents)} documents with {pool.workers} workers "
+            f"x {pool.threads_per_worker} threads"
+        )
+        for texts, embeddings, tokens, seconds in pool.encode_ordered(shards):
+            vector_db.add_embedded_documents(texts, embeddings, metadatas[offset:offset + len(texts)])
+            offset += len(texts)
+            total_tokens += tokens
+            encode_seconds += seconds
+            logger.info(f"Ingested {offset}/{len(documents)} documents")
+        report_workers, report_threads = pool.workers, pool.threads_per_worker
+
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": len(documents),
+        "skipped_duplicates": skipped,
+        "tokens": total_tokens,
+        "ids": all_ids,
+        "workers": report_workers,
+        "threads_per_worker": report_threads,
+        "seconds": round(elapsed, 2),
+        "worker_encode_seconds": round(encode_seconds, 2),
+        "docs_per_second": round(len(documents) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_second": round(total_tokens / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def _iter_files(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for filename in sorted(files):
+                    if filename.endswith((".txt", ".md")):
+                        yield os.path.join(root, filename)
+        else:
+            yield path
+
+
+def load_chunks(paths: List[str]) -> Tuple[List[str], List[Dict], Dict[str, Any]]:
+    """Token-budgeted chunks of text files, as /upload-text-file chunks them."""
+    from text_chunker import TokenChunker, load_tokenizer
+
+    chunker = TokenChunker(load_tokenizer())
+    documents, metadatas = [], []
+    for path in _iter_files(paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            chunks = chunker.chunk_text(f.read())
+        for i, chunk in enumerate(chunks):
+            documents.append(chunk)
+            metadatas.append({"source": os.path.basename(path), "chunk_index": i, "upload_type": "bulk"})
+    return documents, metadatas, chunker.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest text files into the knowledge base")
+    parser.add_argument("paths", nargs="+", help="Text files or directories (.txt/.md)")
+    parser.add_argument("--workers", type=int, default=KBConfig.BULK_INGEST_WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Defaults to available cores / workers")
+    parser.add_argument("--shard-size", type=int, default=64, help="Documents per worker task")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    documents, metadatas, chunking = load_chunks(args.paths)
+    if not documents:
+        print("No content found")
+        return
+    print(f"Chunked into {chunking['chunks']} chunks (mean {chunking['mean_tokens']} tokens, "
+          f"{chunking['hard_splits']} hard splits)")
+
+    from local_vector_db import LocalVectorDB
+    # The workers do the encoding; no model in the coordinating process
+    vector_db = LocalVectorDB(load_embeddings=False)
+    report = bulk_add_documents(vector_db, documents, metadatas, args.workers,
+                                args.threads_per_worker, args.shard_size)
+
+    print(f"Ingested {report['documents']} documents ({report['tokens']} tokens) in {report['seconds']}s, "
+          f"{report['skipped_duplicates']} duplicates skipped")
+    print(f"  {report['workers']} workers x {report['threads_per_worker']} threads")
+    print(f"  {report['docs_per_second']} docs/s, {report['tokens_per_second']} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
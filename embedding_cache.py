@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so trivially different repeats share an entry."""
+    return " ".join(query.split()).casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query embeddings with an optional sqlite tier.
+    Entries are keyed on the normalized query plus the model, dimension and
+    precision that produced them, so a config change never serves stale vectors.
+    """
+
+    def __init__(self, model_name: str, dimension: int, precision: str,
+                 max_entries: int = 1024, db_path: Optional[str] = None,
+                 max_disk_entries: int = 100000):
+        self.namespace = f"{model_name}|{dimension}|{precision}"
+        self.dimension = dimension
+        self.max_entries = max(0, max_entries)
+        self.max_disk_entries = max(0, max_disk_entries)
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if db_path and self.max_disk_entries > 0:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used "
+                    "ON query_embeddings (last_used)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Query cache disk tier disabled: {e}")
+                self._db = None
+
+    def key(self, query: str) -> str:
+        payload = json.dumps([self.namespace, normalize_query(query)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _frozen(vector: np.ndarray) -> np.ndarray:
+        # Shared between callers, so nobody may modify it in place
+        vector.setflags(write=False)
+        return vector
+
+    def _put_memory(self, key: str, vector: np.ndarray):
+        if self.max_entries == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = self.key(query)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        self._db.execute(
+                            "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                            (time.time(), key),
+                        )
+                        self._db.commit()
+                        vector = np.frombuffer(row[0], dtype=np.float32)
+                        if vector.shape[0] == self.dimension:
+                            vector = self._frozen(vector.copy())
+                            self._put_memory(key, vector)
+                            self.disk_hits += 1
+                            return vector
+                except sqlite3.Error as e:
+                    logger.warning(f"Query cache read failed: {e}")
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, vector: np.ndarray) -> np.ndarray:
+        """Store a vector; returns the cached (read-only float32) copy."""
+        key = self.key(query)
+        vector = self._frozen(np.array(vector, dtype=np.float32))
+        with self._lock:
+            self._put_memory(key, vector)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                        (key, vector.tobytes(), time.time()),
+                    )
+                    self._prune_disk()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Query cache write failed: {e}")
+        return vector
+
+    def _prune_disk(self):
+        (count,) = self._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM query_embeddings WHERE key IN ("
+                "SELECT key FROM query_embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_embeddings")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            disk_entries = 0
+            if self._db is not None:
+                (disk_entries,) = self._db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+            return {
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_entries": disk_entries,
+                "max_disk_entries": self.max_disk_entries if self._db is not None else 0,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentEmbeddingStore:
+    """
+    Persistent document embeddings keyed on the text hash plus the model,
+    dimension and precision. Identical chunks - re-uploads, or the same
+    paragraph in several files - are encoded once.
+    """
+
+    def __init__(self, model_name: str, dimension: int, precision: str, db_path: str):
+        self.namespace = f"{model_name}|{dimension}|{precision}"
+        self.dimension = dimension
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # Bulk ingestion workers share the file, so wait on their write locks
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS document_embeddings ("
+            "namespace TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, text_hash))"
+        )
+        self._db.commit()
+
+    def get_many(self, texts: List[str]) -> Dict[int, np.ndarray]:
+        """Map input positions to stored vectors, for the texts that have one."""
+        hashes = [text_hash(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            unique = list(set(hashes))
+            # Stay under sqlite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM document_embeddings "
+                    f"WHERE namespace = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [self.namespace, *chunk],
+                ).fetchall()
+                for digest, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if vector.shape[0] == self.dimension:
+                        found[digest] = vector
+
+            result = {i: found[digest] for i, digest in enumerate(hashes) if digest in found}
+            self.hits += len(result)
+            self.misses += len(texts) - len(result)
+            return result
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        rows = [
+            (self.namespace, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO document_embeddings (namespace, text_hash, vector) "
+                    "VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Document embedding store write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._db.execute(
+                "SELECT COUNT(*) FROM document_embeddings WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
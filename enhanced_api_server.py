@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import asyncio
@@ -8,18 +9,19 @@ import base64
 import numpy as np
 import io
 import wave
-import tempfile
 import shutil
 import os
 import gc
 import torch
 import traceback
 import json
+import time
 
 # Import your existing TTS code
 try:
     # Import the actual api_server app instance for TTS functionality
-    from api_server import app as tts_app, TTSRequest, _generate_tts_internal
+    from api_server import app as tts_app, TTSRequest, _generate_tts_internal, _register_voice_internal, _stream_tts_internal, _resolve_stream_format
+    from tts_audio import wants_binary
     
     TTS_AVAILABLE = True
     print("✅ TTS components imported successfully")
@@ -30,6 +32,9 @@ except ImportError as e:
 
 # Import new RAG functionality
 from rag_service import LocalRAGService
+from local_vector_db import build_where
+from ingestion import IngestionError, IngestionPipeline, detect_kind, spool_upload
+from ingest_jobs import IngestJobQueue
 
 # Configure detailed logging
 logging.basicConfig(
@@ -52,6 +57,16 @@ app.add_middleware(
 # Initialize services
 # tts_service = ChatterboxTTSAPI()  # Your existing TTS service
 rag_service = LocalRAGService()
+ingest_jobs = IngestJobQueue(rag_service.vector_db)
+
+@app.on_event("startup")
+async def start_ingest_worker():
+    # Also resumes jobs left queued or running by the previous process
+    ingest_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_worker():
+    ingest_jobs.stop()
 
 # Request/Response models
 class KnowledgeChatRequest(BaseModel):
@@ -60,6 +75,8 @@ class KnowledgeChatRequest(BaseModel):
     conversation_id: Optional[str] = "default"
     use_default_voice: bool = True
     system_prompt: Optional[str] = None  # Custom system prompt from persona configuration
+    # Restrict retrieval by metadata: {"source" | "type" | "upload_type": value or [values]}
+    filters: Optional[Dict[str, Any]] = None
 
 class KnowledgeChatResponse(BaseModel):
     text_response: str
@@ -67,11 +84,21 @@ class KnowledgeChatResponse(BaseModel):
     sources_used: int
     relevance_scores: List[float]
     tokens_used: int
+    timings: Optional[Dict[str, Any]] = None  # Per-stage milliseconds (embed, search, rerank, generation)
     success: bool
 
 class AddKnowledgeRequest(BaseModel):
     documents: List[str]
     metadatas: Optional[List[Dict[str, Any]]] = None
+    background: bool = False  # Queue as an ingestion job and return its ID
+
+class SearchBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = None
+    filters: Optional[Dict[str, Any]] = None  # Same as KnowledgeChatRequest.filters
+
+# Upper bound on queries per /search-batch call
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "256"))
 
 # Store conversations in memory (for local use)
 conversations: Dict[str, List[Dict]] = {}
@@ -82,6 +109,18 @@ async def chat_with_knowledge(request: KnowledgeChatRequest):
     Main endpoint: Chat with AI using knowledge base + voice generation.
     Integrates perfectly with your existing ChatterboxTTS setup.
     """
+    _validate_filters(request.filters)
+    # Background ingestion pauses between batches while this runs
+    with ingest_jobs.foreground():
+        return await _chat_with_knowledge(request)
+
+def _validate_filters(filters: Optional[Dict[str, Any]]):
+    try:
+        build_where(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _chat_with_knowledge(request: KnowledgeChatRequest):
     try:
         # 1. Get conversation history
         conversation_history = conversations.get(request.conversation_id, [])
@@ -92,9 +131,10 @@ async def chat_with_knowledge(request: KnowledgeChatRequest):
         if request.system_prompt:
             # Create a custom generate_response call with persona system prompt
             user_query = request.message
-            relevant_docs = rag_service.vector_db.search_similar(
+            relevant_docs, timings = rag_service.retrieve(
                 user_query, 
-                top_k=5
+                top_k=5,
+                filters=request.filters
             )
             
             # Prepare context from retrieved documents
@@ -129,6 +169,7 @@ INSTRUCTIONS:
             try:
                 from openai import OpenAI
                 client = OpenAI()
+                generation_start = time.perf_counter()
                 response = client.chat.completions.create(
                     model="gpt-3.5-turbo",
                     messages=messages,
@@ -139,11 +180,13 @@ INSTRUCTIONS:
                 
                 ai_response = response.choices[0].message.content.strip()
                 tokens_used = response.usage.total_tokens
+                timings["generation_ms"] = round((time.perf_counter() - generation_start) * 1000, 1)
                 
                 rag_result = {
                     "response": ai_response,
                     "sources": relevant_docs,
                     "tokens_used": tokens_used,
+                    "timings": timings,
                     "success": True
                 }
             except Exception as e:
@@ -158,7 +201,8 @@ INSTRUCTIONS:
             # Use default RAG service
             rag_result = rag_service.generate_response(
                 request.message,
-                conversation_history
+                conversation_history,
+                filters=request.filters
             )
         
         if not rag_result["success"]:
@@ -194,6 +238,7 @@ INSTRUCTIONS:
             sources_used=len(rag_result["sources"]),
             relevance_scores=relevance_scores,
             tokens_used=rag_result["tokens_used"],
+            timings=rag_result.get("timings"),
             success=True
         )
         
@@ -204,6 +249,10 @@ INSTRUCTIONS:
 @app.post("/add-knowledge")
 async def add_knowledge(request: AddKnowledgeRequest):
     """Add documents to the local knowledge base."""
+    if request.background:
+        job_id = ingest_jobs.submit_documents(request.documents, request.metadatas)
+        return _job_accepted(job_id)
+    
     try:
         result = rag_service.add_knowledge(
             request.documents,
@@ -216,118 +265,105 @@ async def add_knowledge(request: AddKnowledgeRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload-text-file")
-async def upload_text_file(file: UploadFile = File(...)):
-    """Upload a text file and add it to knowledge base."""
+async def upload_text_file(
+    file: UploadFile = File(...),
+    mode: str = Form("append"),
+    progress: bool = Form(False),
+    background: bool = Form(False)
+):
+    """
+    Upload a text file and add it to knowledge base.
+    The file is spooled to disk and streamed through extraction, chunking
+    and embedding in batches, so memory use does not grow with file size.
+    mode=update replaces the chunks previously uploaded from the same
+    filename: only new or changed chunks are embedded, removed ones are deleted.
+    progress=true streams NDJSON progress events, ending with the result.
+    background=true queues an ingestion job and returns its ID immediately.
+    """
+    if mode not in ("append", "update"):
+        raise HTTPException(status_code=400, detail="mode must be 'append' or 'update'")
+    
+    logger.info(f"Processing file upload: {file.filename} (type: {file.content_type}, mode: {mode})")
     try:
-        logger.info(f"Processing file upload: {file.filename} (type: {file.content_type})")
-        
-        # Read file content
-        content = await file.read()
-        logger.debug(f"Read {len(content)} bytes from file")
+        # Background jobs keep their upload in the job spool until processed
+        tmp_path, size = await spool_upload(file, ingest_jobs.spool_dir if background else None)
+    except Exception as e:
+        logger.error(f"Could not spool upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    logger.debug(f"Spooled {size} bytes to {tmp_path}")
+    
+    kind = detect_kind(file.filename, file.content_type)
+    if background:
+        job_id = ingest_jobs.submit_file(
+            tmp_path, file.filename, kind, update=(mode == "update"),
+            extra_metadata={"upload_type": "file"}
+        )
+        return _job_accepted(job_id, file_size_kb=size / 1024)
+    
+    loop = asyncio.get_running_loop()
+    
+    def build_response(report: Dict[str, Any]) -> Dict[str, Any]:
+        report = dict(report, knowledge_base_stats=rag_service.vector_db.get_stats())
+        response = {
+            "message": f"Successfully processed {file.filename}",
+            "mode": mode,
+            "chunks_added": report["added"],
+            "duplicates_skipped": report["skipped_duplicates"],
+            "file_size_kb": size / 1024,
+            "chunking": report.get("chunking"),
+            "result": report
+        }
+        if mode == "update":
+            response["chunks_removed"] = report["removed"]
+            response["chunks_unchanged"] = report["unchanged"]
+        return response
+    
+    def run_pipeline(emit=None):
+        pipeline = IngestionPipeline(rag_service.vector_db, progress=emit)
+        return pipeline.run(
+            tmp_path, file.filename, kind=kind, update=(mode == "update"),
+            extra_metadata={"upload_type": "file"}
+        )
+    
+    if progress:
+        events: asyncio.Queue = asyncio.Queue()
         
-        # Try different encodings
-        encodings = ['utf-8', 'latin-1', 'cp1252']
-        text_content = None
+        def emit(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
         
-        for encoding in encodings:
+        async def run_and_report():
             try:
-                text_content = content.decode(encoding)
-                logger.debug(f"Successfully decoded file using {encoding} encoding")
-                break
-            except UnicodeDecodeError:
-                logger.debug(f"Failed to decode using {encoding} encoding")
-                continue
-        
-        if text_content is None:
-            # For PDF and DOCX files, we need to use a library to extract text
-            if file.content_type in ['application/pdf', 'application/msword', 
-                                   'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-                logger.info(f"Processing {file.content_type} file")
-                
-                # Save file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-                    tmp_file.write(content)
-                    tmp_path = tmp_file.name
-                    logger.debug(f"Saved temporary file to {tmp_path}")
-                
-                try:
-                    # Extract text based on file type
-                    if file.content_type == 'application/pdf':
-                        logger.info("Extracting text from PDF")
-                        import PyPDF2
-                        with open(tmp_path, 'rb') as pdf_file:
-                            pdf_reader = PyPDF2.PdfReader(pdf_file)
-                            text_content = '\n\n'.join(page.extract_text() for page in pdf_reader.pages)
-                            logger.info(f"Extracted {len(pdf_reader.pages)} pages from PDF")
-                    else:  # DOC or DOCX
-                        logger.info("Extracting text from Word document")
-                        import docx2txt
-                        text_content = docx2txt.process(tmp_path)
-                        logger.info("Successfully extracted text from Word document")
-                except Exception as e:
-                    logger.error(f"Error extracting text from document: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to extract text from document: {str(e)}"
-                    )
-                finally:
-                    # Clean up temporary file
-                    if os.path.exists(tmp_path):
-                        os.unlink(tmp_path)
-                        logger.debug("Cleaned up temporary file")
-            else:
-                logger.error(f"Could not decode file content: unsupported format {file.content_type}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Could not decode file content: unsupported format {file.content_type}"
-                )
-        
-        if not text_content or not text_content.strip():
-            logger.error("No valid content found in file")
-            raise HTTPException(status_code=400, detail="No valid content found in file")
-        
-        # Simple paragraph-based chunking
-        paragraphs = [
-            para.strip() 
-            for para in text_content.split('\n\n') 
-            if para.strip() and len(para.strip()) > 50
-        ]
-        
-        logger.info(f"Split content into {len(paragraphs)} paragraphs")
-        
-        if not paragraphs:
-            logger.error("No valid paragraphs found after processing")
-            raise HTTPException(status_code=400, detail="No valid content found in file")
-        
-        # Create metadata for each chunk
-        metadatas = [
-            {
-                "source": file.filename,
-                "chunk_index": i,
-                "upload_type": "file"
-            } 
-            for i in range(len(paragraphs))
-        ]
+                report = await loop.run_in_executor(None, run_pipeline, emit)
+                events.put_nowait(dict(build_response(report), stage="done"))
+            except Exception as e:
+                logger.error(f"Error in streaming file upload: {str(e)}")
+                events.put_nowait({"stage": "error", "detail": str(e)})
+            finally:
+                os.unlink(tmp_path)
+                events.put_nowait(None)
         
-        # Add to knowledge base
-        logger.info("Adding content to knowledge base")
-        result = rag_service.add_knowledge(paragraphs, metadatas)
-        logger.info("Successfully added content to knowledge base")
+        # Held by the generator so the task is not garbage collected mid-run
+        task = asyncio.create_task(run_and_report())
         
-        response = {
-            "message": f"Successfully processed {file.filename}",
-            "chunks_added": len(paragraphs),
-            "file_size_kb": len(content) / 1024,
-            "result": result
-        }
+        async def stream_events():
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+            await task
         
+        return StreamingResponse(stream_events(), media_type="application/x-ndjson")
+    
+    try:
+        report = await loop.run_in_executor(None, run_pipeline)
+        response = build_response(report)
         logger.debug(f"Response: {json.dumps(response, indent=2)}")
         return response
         
-    except HTTPException as he:
-        logger.error(f"HTTP Exception in file upload: {str(he)}")
-        raise he
+    except IngestionError as e:
+        logger.error(f"Could not ingest {file.filename}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error in file upload: {str(e)}")
         logger.error(traceback.format_exc())
@@ -335,6 +371,63 @@ async def upload_text_file(file: UploadFile = File(...)):
             status_code=500,
             detail=f"Error processing file: {str(e)}"
         )
+    finally:
+        os.unlink(tmp_path)
+
+def _job_accepted(job_id: str, **extra) -> JSONResponse:
+    return JSONResponse(status_code=202, content={
+        "message": "Ingestion job queued",
+        "job_id": job_id,
+        "status_url": f"/ingest-jobs/{job_id}",
+        **extra
+    })
+
+@app.get("/ingest-jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """Status, progress, throughput and error of a background ingestion job."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job {job_id} not found")
+    return job
+
+@app.get("/ingest-jobs")
+async def list_ingest_jobs(limit: int = 50):
+    """Most recent background ingestion jobs."""
+    return {"counts": ingest_jobs.counts(), "jobs": ingest_jobs.list(limit)}
+
+@app.post("/search-batch")
+async def search_batch(request: SearchBatchRequest):
+    """
+    Retrieve for many queries in one call (offline evaluation, multi-query
+    retrieval): queries are encoded together and searched in a single
+    vector query, with the same similarity threshold and filters as chat
+    retrieval.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUERIES} queries per request"
+        )
+    _validate_filters(request.filters)
+    
+    try:
+        start_time = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None, rag_service.vector_db.search_many, request.queries, request.top_k, request.filters
+        )
+        return {
+            "results": [
+                {"query": query, "matches": matches}
+                for query, matches in zip(request.queries, results)
+            ],
+            "seconds": round(time.perf_counter() - start_time, 3)
+        }
+    except Exception as e:
+        logger.error(f"Error in batch search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/knowledge-stats")
 async def get_knowledge_stats():
@@ -354,9 +447,21 @@ async def reset_knowledge():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _audio_response(result, http_request: Request, response_format: Optional[str] = None):
+    """Raw audio when the client asks for it, legacy base64 JSON otherwise."""
+    if wants_binary(http_request.headers.get("accept"), response_format):
+        return Response(content=result.audio_bytes, media_type=result.media_type, headers=result.headers())
+    
+    return {
+        "audio_base64": base64.b64encode(result.audio_bytes).decode("ascii"),
+        "sample_rate": result.sample_rate,
+        "format": result.format,
+        "bytes_saved": result.bytes_saved
+    }
+
 # Keep your existing TTS endpoints unchanged but integrate them
 @app.post("/tts")
-async def text_to_speech(request: dict):
+async def text_to_speech(request: dict, http_request: Request):
     """Your existing TTS endpoint - integrated with knowledge base responses."""
     if not TTS_AVAILABLE:
         raise HTTPException(status_code=503, detail="TTS service not available")
@@ -369,31 +474,58 @@ async def text_to_speech(request: dict):
             temperature=request.get("temperature", 0.8),
             cfg_weight=request.get("cfg_weight", 0.5),
             seed=request.get("seed", 0),
-            audio_file=None
+            audio_file=None,
+            voice_id=request.get("voice_id"),
+            audio_format=request.get("format", "wav"),
+            bitrate=request.get("bitrate")
         )
         
         # Convert the result to expected format
-        return {
-            "audio_base64": result.audio_base64,
-            "sample_rate": result.sample_rate
-        }
+        return _audio_response(result, http_request, request.get("response_format"))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"TTS generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/tts-stream")
+async def text_to_speech_stream(request: dict, format: Optional[str] = None):
+    """Stream TTS audio sentence by sentence, e.g. for long knowledge base answers."""
+    if not TTS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="TTS service not available")
+    
+    stream_format = _resolve_stream_format(request.get("format"), format)
+    return await _stream_tts_internal(
+        text=request.get("text", ""),
+        exaggeration=request.get("exaggeration", 0.5),
+        temperature=request.get("temperature", 0.8),
+        cfg_weight=request.get("cfg_weight", 0.5),
+        seed=request.get("seed", 0),
+        voice_id=request.get("voice_id"),
+        stream_format=stream_format
+    )
+
 @app.post("/tts-with-voice")
 async def tts_with_voice_cloning(
+    http_request: Request,
     text: str = Form(...),
     exaggeration: float = Form(0.5),
     temperature: float = Form(0.8),
     cfg_weight: float = Form(0.5),
     seed: int = Form(0),
-    voice: UploadFile = File(...)
+    voice: Optional[UploadFile] = File(None),
+    voice_id: Optional[str] = Form(None),
+    response_format: Optional[str] = Form(None),
+    format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
 ):
     """Voice cloning endpoint - integrated with knowledge base."""
     if not TTS_AVAILABLE:
         raise HTTPException(status_code=503, detail="TTS service not available")
     
+    if voice is None and not voice_id:
+        raise HTTPException(status_code=400, detail="Provide either a voice file or a voice_id")
+    
     try:
         # Use the internal TTS generation function with voice file
         result = await _generate_tts_internal(
@@ -402,19 +534,29 @@ async def tts_with_voice_cloning(
             temperature=temperature,
             cfg_weight=cfg_weight,
             seed=seed,
-            audio_file=voice
+            audio_file=voice,
+            voice_id=voice_id,
+            audio_format=format,
+            bitrate=bitrate
         )
         
         # Convert the result to expected format
-        return {
-            "audio_base64": result.audio_base64,
-            "sample_rate": result.sample_rate
-        }
+        return _audio_response(result, http_request, response_format)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Voice cloning error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/voices")
+async def register_voice(voice: UploadFile = File(...), name: Optional[str] = Form(None)):
+    """Register a reference clip once and reuse it by voice_id."""
+    if not TTS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="TTS service not available")
+    
+    return await _register_voice_internal(audio_file=voice, name=name)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -0,0 +1,252 @@
+"""
+Durable background ingestion jobs.
+
+Jobs are recorded in sqlite before the request returns and processed one
+at a time by a worker thread running at a lower OS priority. Between
+batches the worker waits while queries are in flight, so ingestion only
+uses the gaps in query traffic. Jobs left running by a crash or restart
+are queued again on startup; ingestion is idempotent thanks to
+content-hash chunk IDs, so redoing a partial job only embeds what is missing.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from kb_config import KBConfig
+from ingestion import IngestionPipeline
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = ("id", "kind", "status", "payload", "file_path", "created_at",
+               "started_at", "finished_at", "attempts", "progress", "result", "error")
+
+
+class IngestJobQueue:
+    """
+    sqlite-backed job queue with a single low-priority worker thread.
+    Job kinds: "documents" (payload holds documents + metadatas) and
+    "file" (an upload spooled into `spool_dir`, processed by IngestionPipeline).
+    """
+
+    def __init__(self, vector_db, db_path: Optional[str] = None, spool_dir: Optional[str] = None,
+                 worker_nice: Optional[int] = None, max_yield_s: float = 2.0):
+        self.vector_db = vector_db
+        self.db_path = db_path or KBConfig.INGEST_JOBS_DB
+        self.spool_dir = spool_dir or KBConfig.INGEST_JOBS_DIR
+        self.worker_nice = KBConfig.INGEST_WORKER_NICE if worker_nice is None else worker_nice
+        self.max_yield_s = max_yield_s
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "payload TEXT NOT NULL, file_path TEXT, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "progress TEXT, result TEXT, error TEXT)"
+            )
+            # Resume jobs interrupted by a restart
+            resumed = self._db.execute(
+                "UPDATE ingest_jobs SET status = 'queued' WHERE status = 'running'"
+            ).rowcount
+            self._db.commit()
+        if resumed:
+            logger.info(f"Re-queued {resumed} interrupted ingestion jobs")
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+        # Foreground (query) requests in flight; the worker yields to them
+        self._active_queries = 0
+        self._idle = threading.Condition()
+
+    # ---- submission ---------------------------------------------------
+
+    def _insert(self, kind: str, payload: Dict[str, Any], file_path: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO ingest_jobs (id, kind, status, payload, file_path, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), file_path, time.time()),
+            )
+            self._db.commit()
+        self._wakeup.set()
+        return job_id
+
+    def submit_documents(self, documents: List[str], metadatas: Optional[List[Dict]] = None) -> str:
+        return self._insert("documents", {"documents": documents, "metadatas": metadatas})
+
+    def submit_file(self, file_path: str, source: str, kind: str, update: bool,
+                    extra_metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Queue a file already spooled into `spool_dir`; the job owns and deletes it."""
+        payload = {"source": source, "kind": kind, "update": update, "extra_metadata": extra_metadata}
+        return self._insert("file", payload, file_path)
+
+    # ---- status -------------------------------------------------------
+
+    @staticmethod
+    def _row_to_status(row: sqlite3.Row) -> Dict[str, Any]:
+        status = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "attempts": row["attempts"],
+            "progress": json.loads(row["progress"]) if row["progress"] else {},
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+        payload = json.loads(row["payload"])
+        if row["kind"] == "file":
+            status["source"] = payload["source"]
+        return status
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_status(row) if row else None
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT * FROM ingest_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_status(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._db_lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock:
+            self._db.execute(f"UPDATE ingest_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    # ---- yielding to queries ------------------------------------------
+
+    @contextmanager
+    def foreground(self):
+        """Mark a query in flight; background batches wait until it finishes."""
+        with self._idle:
+            self._active_queries += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._active_queries -= 1
+                if self._active_queries == 0:
+                    self._idle.notify_all()
+
+    def _yield_to_queries(self):
+        # Bounded wait so a steady query stream cannot starve ingestion forever
+        with self._idle:
+            self._idle.wait_for(lambda: self._active_queries == 0, timeout=self.max_yield_s)
+
+    # ---- worker -------------------------------------------------------
+
+    def start(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="ingest-jobs", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def _lower_priority(self):
+        if self.worker_nice and hasattr(os, "setpriority"):
+            try:
+                # On Linux a thread id addresses just this thread
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.worker_nice)
+            except OSError as e:
+                logger.warning(f"Could not lower ingestion worker priority: {e}")
+
+    def _next_job(self) -> Optional[sqlite3.Row]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT * FROM ingest_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE ingest_jobs SET status = 'running', started_at = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (time.time(), row["id"]),
+                )
+                self._db.commit()
+        return row
+
+    def _run(self):
+        self._lower_priority()
+        while not self._stop.is_set():
+            row = self._next_job()
+            if row is None:
+                self._wakeup.wait(timeout=5.0)
+                self._wakeup.clear()
+                continue
+            self._process(row)
+
+    def _process(self, row: sqlite3.Row):
+        job_id = row["id"]
+        started = time.perf_counter()
+        logger.info(f"Ingestion job {job_id} ({row['kind']}) started")
+
+        def progress(event: Dict[str, Any]):
+            if event.get("stage") == "ingesting":
+                elapsed = time.perf_counter() - started
+                event = dict(event, chunks_per_second=round(event["chunks"] / elapsed, 2) if elapsed else 0.0)
+                self._update(job_id, progress=json.dumps(event))
+                self._yield_to_queries()
+
+        try:
+            payload = json.loads(row["payload"])
+            if row["kind"] == "file":
+                pipeline = IngestionPipeline(self.vector_db, progress=progress)
+                result = pipeline.run(
+                    row["file_path"], payload["source"], kind=payload["kind"],
+                    update=payload["update"], extra_metadata=payload["extra_metadata"]
+                )
+            else:
+                result = self._ingest_documents(payload["documents"], payload["metadatas"], progress)
+            elapsed = time.perf_counter() - started
+            result["chunks_per_second"] = round(result["chunks"] / elapsed, 2) if elapsed else 0.0
+            self._update(job_id, status="done", finished_at=time.time(), result=json.dumps(result))
+            logger.info(f"Ingestion job {job_id} done in {elapsed:.1f}s")
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            self._update(job_id, status="failed", finished_at=time.time(), error=str(e))
+        finally:
+            if row["file_path"] and os.path.exists(row["file_path"]):
+                os.unlink(row["file_path"])
+
+    def _ingest_documents(self, documents: List[str], metadatas: Optional[List[Dict]], progress) -> Dict[str, Any]:
+        added = 0
+        skipped = 0
+        batch_size = KBConfig.INGEST_BATCH_SIZE
+        for start in range(0, len(documents), batch_size):
+            report = self.vector_db.ingest_documents(
+                documents[start:start + batch_size],
+                metadatas[start:start + batch_size] if metadatas else None
+            )
+            added += report["added"]
+            skipped += report["skipped_duplicates"]
+            progress({"stage": "ingesting", "chunks": min(start + batch_size, len(documents)), "added": added})
+        return {"added": added, "skipped_duplicates": skipped, "chunks": len(documents)}
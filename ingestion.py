@@ -0,0 +1,253 @@
+"""
+Streaming document ingestion.
+
+An upload is spooled to disk in fixed-size pieces, then text is extracted
+page by page (PDF) or decoded incrementally (plain text), cut into chunks
+on the fly by the token-aware chunker and embedded/stored in batches.
+Extraction and embedding run in separate threads joined by a bounded
+queue, so a fast extractor waits for the encoder instead of piling text
+up in memory. Peak memory depends on the batch and queue sizes, not on
+the file size.
+"""
+import codecs
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from kb_config import KBConfig
+from text_chunker import TokenChunker
+import logging
+
+logger = logging.getLogger(__name__)
+
+SPOOL_CHUNK_BYTES = 1024 * 1024
+TEXT_READ_BYTES = 64 * 1024
+MIN_CHUNK_CHARS = 50
+
+PDF_TYPES = ("application/pdf",)
+WORD_TYPES = (
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+)
+
+_DONE = object()
+
+
+class IngestionError(Exception):
+    """The upload could not be read or decoded"""
+
+
+async def spool_upload(upload, directory: Optional[str] = None) -> Tuple[str, int]:
+    """Copy an UploadFile to a temporary file piece by piece; returns (path, size)."""
+    suffix = os.path.splitext(upload.filename or "")[1]
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory) as tmp_file:
+        while True:
+            piece = await upload.read(SPOOL_CHUNK_BYTES)
+            if not piece:
+                break
+            tmp_file.write(piece)
+            size += len(piece)
+    return tmp_file.name, size
+
+
+def detect_kind(filename: Optional[str], content_type: Optional[str]) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if content_type in PDF_TYPES or extension == ".pdf":
+        return "pdf"
+    if content_type in WORD_TYPES or extension in (".doc", ".docx"):
+        return "word"
+    return "text"
+
+
+def _sniff_text_encoding(path: str) -> str:
+    """utf-8 if the whole file decodes as utf-8, otherwise latin-1 (never fails)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            while True:
+                piece = f.read(TEXT_READ_BYTES)
+                if not piece:
+                    decoder.decode(b"", final=True)
+                    return "utf-8"
+                decoder.decode(piece)
+        except UnicodeDecodeError:
+            return "latin-1"
+
+
+def iter_text_blocks(path: str, kind: str, progress: Callable[[Dict[str, Any]], None]) -> Iterator[str]:
+    """
+    Yield the document's text in blocks: one page at a time for PDFs,
+    fixed-size decoded pieces for text files. A block ending in a blank
+    line closes the current paragraph.
+    """
+    if kind == "pdf":
+        import PyPDF2
+        with open(path, "rb") as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            total = len(reader.pages)
+            for page_number, page in enumerate(reader.pages, 1):
+                yield (page.extract_text() or "") + "\n\n"
+                progress({"stage": "extracting", "page": page_number, "pages": total})
+        return
+
+    if kind == "word":
+        # docx2txt only extracts whole documents; Word files are small next to PDFs
+        import docx2txt
+        yield docx2txt.process(path)
+        return
+
+    encoding = _sniff_text_encoding(path)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    bytes_read = 0
+    with open(path, "rb") as f:
+        while True:
+            piece = f.read(TEXT_READ_BYTES)
+            if not piece:
+                yield decoder.decode(b"", final=True)
+                return
+            bytes_read += len(piece)
+            yield decoder.decode(piece)
+            progress({"stage": "extracting", "bytes_read": bytes_read})
+
+
+def iter_paragraph_chunks(blocks: Iterator[str], min_chars: int = MIN_CHUNK_CHARS) -> Iterator[str]:
+    """Paragraph chunking (blank-line separated, longer than min_chars) across block borders."""
+    carry = ""
+    for block in blocks:
+        parts = (carry + block).replace("\r\n", "\n").split("\n\n")
+        # The last part may continue in the next block
+        carry = parts.pop()
+        for part in parts:
+            part = part.strip()
+            if len(part) > min_chars:
+                yield part
+    carry = carry.strip()
+    if len(carry) > min_chars:
+        yield carry
+
+
+class IngestionPipeline:
+    """
+    extract -> chunk (producer thread) -> bounded queue -> embed + store
+    (calling thread). With update=True, chunks replace the source's previous
+    ones; otherwise they are added, skipping chunks already stored.
+    """
+
+    def __init__(self, vector_db, batch_size: Optional[int] = None, queue_size: Optional[int] = None,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 chunker: Optional[TokenChunker] = None):
+        self.vector_db = vector_db
+        if chunker is None and getattr(vector_db, "embeddings", None) is not None:
+            model = vector_db.embeddings.model
+            chunker = TokenChunker(model.tokenizer, model_max_tokens=model.max_seq_length)
+        # Without an embedding model (and so a tokenizer) fall back to paragraphs
+        self.chunker = chunker
+        self.batch_size = batch_size or KBConfig.INGEST_BATCH_SIZE
+        self.queue_size = queue_size or KBConfig.INGEST_QUEUE_SIZE
+        self.progress = progress or (lambda event: None)
+
+    def _produce(self, chunks: Iterator[str], out: queue.Queue, stop: threading.Event, errors: List):
+        try:
+            for chunk in chunks:
+                # Blocks while the encoder is behind (backpressure)
+                while not stop.is_set():
+                    try:
+                        out.put(chunk, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            while not stop.is_set():
+                try:
+                    out.put(_DONE, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def run(self, path: str, source: str, kind: str = "text", update: bool = False,
+            extra_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        sync = None
+        if update:
+            from local_vector_db import SourceSync
+            sync = SourceSync(self.vector_db, source)
+        blocks = iter_text_blocks(path, kind, self.progress)
+        if self.chunker is not None:
+            self.chunker.reset_stats()
+            chunks = self.chunker.iter_chunks(blocks)
+        else:
+            chunks = iter_paragraph_chunks(blocks)
+
+        handoff: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors: List[Exception] = []
+        producer = threading.Thread(
+            target=self._produce, args=(chunks, handoff, stop, errors), name="ingest-extract", daemon=True
+        )
+        producer.start()
+
+        chunk_index = 0
+        added = 0
+        skipped = 0
+        batch: List[str] = []
+
+        def flush():
+            nonlocal added, skipped, batch
+            metadatas = [
+                dict(extra_metadata or {}, source=source, chunk_index=chunk_index - len(batch) + i)
+                for i in range(len(batch))
+            ]
+            if sync is not None:
+                sync.add_batch(batch, metadatas)
+            else:
+                report = self.vector_db.ingest_documents(batch, metadatas)
+                added += report["added"]
+                skipped += report["skipped_duplicates"]
+            batch = []
+            self.progress({
+                "stage": "ingesting",
+                "chunks": chunk_index,
+                "added": sync.added if sync is not None else added,
+                "elapsed_s": round(time.perf_counter() - start_time, 2),
+            })
+
+        try:
+            while True:
+                item = handoff.get()
+                if item is _DONE:
+                    break
+                batch.append(item)
+                chunk_index += 1
+                if len(batch) >= self.batch_size:
+                    flush()
+            if errors:
+                raise IngestionError(f"Failed to extract text: {errors[0]}") from errors[0]
+            if batch:
+                flush()
+        finally:
+            stop.set()
+            producer.join()
+
+        if chunk_index == 0:
+            raise IngestionError("No valid content found in file")
+
+        if sync is not None:
+            report = sync.finish()
+            report.pop("ids")
+        else:
+            report = {"added": added, "skipped_duplicates": skipped}
+        report.update({
+            "chunks": chunk_index,
+            "seconds": round(time.perf_counter() - start_time, 2),
+        })
+        if self.chunker is not None:
+            report["chunking"] = self.chunker.stats()
+        return report
@@ -11,14 +11,73 @@ class KBConfig:
     # Stella Embedding Model
     EMBEDDING_MODEL = "NovaSearch/stella_en_1.5B_v5"
     EMBEDDING_DIMENSION = 1024  # Good balance of performance vs storage
+    # Inference precision: auto (bf16/fp16 on GPU, fp32 on CPU), fp32, fp16, bf16,
+    # or int8 (dynamic quantization of Linear layers, CPU only)
+    EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "auto").lower()
+    # Document batches are packed up to this many padded tokens; "auto" sizes
+    # it from free GPU memory or the CPU thread count
+    EMBEDDING_TOKEN_BUDGET = os.getenv("EMBEDDING_TOKEN_BUDGET", "auto")
+    EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "256"))
+    # Chunking: token budget per chunk (Stella reads at most 512 tokens incl.
+    # special tokens), sentence-aligned overlap, and the size below which a
+    # chunk is dropped as noise (page numbers, stray headers)
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "500"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+    CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "8"))
+    
+    # Streaming upload ingestion: chunks per embed/store batch, and how many
+    # extracted chunks may wait for the encoder
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "256"))
+    # Background ingestion jobs (sqlite job table + spooled uploads)
+    INGEST_JOBS_DB = os.getenv("INGEST_JOBS_DB", "./ingest_jobs/jobs.sqlite")
+    INGEST_JOBS_DIR = os.getenv("INGEST_JOBS_DIR", "./ingest_jobs/uploads")
+    INGEST_WORKER_NICE = int(os.getenv("INGEST_WORKER_NICE", "10"))  # 0 keeps normal priority
+    # Embedding processes for bulk_ingest.py (each loads its own model copy)
+    BULK_INGEST_WORKERS = int(os.getenv("BULK_INGEST_WORKERS", "2"))
+    
+    # Query embedding cache (in-memory LRU + sqlite tier; empty path disables disk)
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "./embedding_cache/queries.sqlite")
+    QUERY_CACHE_DISK_ENTRIES = int(os.getenv("QUERY_CACHE_DISK_ENTRIES", "100000"))
+    # Document embeddings by content hash, so unchanged chunks are never re-encoded
+    # (empty path disables)
+    DOCUMENT_EMBEDDING_STORE_PATH = os.getenv("DOCUMENT_EMBEDDING_STORE_PATH", "./embedding_cache/documents.sqlite")
     
     # Local Vector Database
     CHROMA_PERSIST_DIRECTORY = "./knowledge_db"
     COLLECTION_NAME = "local_knowledge"
+    # Vector storage: chroma (HNSW, float32), flat (exact search over a
+    # memory-mapped float32 matrix), or int8 / binary codes with float16
+    # rescoring; the local backends live in VECTOR_STORE_DIRECTORY (see vector_store.py)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+    VECTOR_STORE_DIRECTORY = os.getenv("VECTOR_STORE_DIRECTORY", "./vector_store")
+    # Candidates rescored per requested result (default: 8 for int8, 32 for binary)
+    VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "0")) or None
+    # HNSW graph of the chroma collection (defaults are Chroma's). M and
+    # construction_ef are fixed when the collection is created, so changing
+    # them needs a reset and re-ingest; tune all three with tune_hnsw.py
+    HNSW_M = int(os.getenv("HNSW_M", "16"))
+    HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "100"))
+    HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "10"))
+    # Vectors buffered before they are inserted into the graph, and before
+    # the graph is written to disk
+    HNSW_BATCH_SIZE = int(os.getenv("HNSW_BATCH_SIZE", "100"))
+    HNSW_SYNC_THRESHOLD = int(os.getenv("HNSW_SYNC_THRESHOLD", "1000"))
     
     # RAG Settings
     TOP_K_RESULTS = 5
     SIMILARITY_THRESHOLD = 0.3
+    # Optional second stage: rerank RERANK_CANDIDATES bi-encoder hits with a
+    # cross-encoder and keep the best. If scoring would exceed
+    # RERANK_BUDGET_MS, the bi-encoder order is used instead
+    RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+    RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANKER_DEVICE = os.getenv("RERANKER_DEVICE", "cpu")
+    RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+    RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+    RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))  # query + passage tokens
+    RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
     MAX_CONTEXT_LENGTH = 4000
     
     # Your existing TTS settings
@@ -1,131 +1,347 @@
-import chromadb
-from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
-import uuid
-import os
+from typing import List, Dict, Any, Optional, Tuple
+import hashlib
+import numpy as np
+import time
 from kb_config import KBConfig
 from stella_embeddings import StellaEmbeddingService
+from vector_store import VECTOR_BACKENDS, open_vector_store
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Metadata fields retrieval can be scoped by
+FILTER_FIELDS = ("source", "type", "upload_type")
+
+def content_id(text: str, source: str) -> str:
+    """Deterministic chunk ID: the same text from the same source always maps to one entry."""
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Vector store `where` clause from {field: value or [values]} over
+    FILTER_FIELDS; a list matches any of its values. None for no filter.
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unsupported filter field(s) {sorted(unknown)} (choose from {', '.join(FILTER_FIELDS)})")
+    
+    conditions = []
+    for field, value in filters.items():
+        if isinstance(value, (list, tuple)):
+            if not value:
+                raise ValueError(f"Filter '{field}' needs at least one value")
+            conditions.append({field: {"$in": list(value)}})
+        else:
+            conditions.append({field: {"$eq": value}})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
 class LocalVectorDB:
-    def __init__(self):
-        """Initialize local ChromaDB with persistence."""
-        # Create directory if it doesn't exist
-        os.makedirs(KBConfig.CHROMA_PERSIST_DIRECTORY, exist_ok=True)
-        
-        # Initialize ChromaDB client
-        self.client = chromadb.PersistentClient(
-            path=KBConfig.CHROMA_PERSIST_DIRECTORY,
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
+    def __init__(self, load_embeddings: bool = True):
+        """
+        Initialize the persistent vector store selected by KBConfig.VECTOR_BACKEND.
+        load_embeddings=False skips loading Stella, for processes that only
+        write vectors encoded elsewhere (see bulk_ingest.py).
+        """
+        self.backend = KBConfig.VECTOR_BACKEND.lower()
+        if self.backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown VECTOR_BACKEND '{self.backend}' (choose from {', '.join(VECTOR_BACKENDS)})")
         
         # Initialize Stella embeddings
-        self.embeddings = StellaEmbeddingService()
+        self.embeddings = StellaEmbeddingService() if load_embeddings else None
         
         # Get or create collection
-        self._init_collection()
-        
-    def _init_collection(self):
-        """Initialize the knowledge collection."""
-        try:
-            self.collection = self.client.get_collection(
-                name=KBConfig.COLLECTION_NAME
-            )
-            count = self.collection.count()
-            logger.info(f"Loaded existing collection with {count} documents")
-        except:
-            self.collection = self.client.create_collection(
-                name=KBConfig.COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"}
-            )
-            logger.info("Created new knowledge collection")
+        self.collection = open_vector_store(self.backend)
+        logger.info(f"Loaded {self.backend} knowledge collection with {self.collection.count()} documents")
     
     def add_documents(self, 
                      documents: List[str], 
                      metadatas: Optional[List[Dict]] = None) -> List[str]:
         """Add documents to the local knowledge base."""
-        if not documents:
-            return []
-        
-        logger.info(f"Adding {len(documents)} documents to knowledge base...")
-        
-        # Generate embeddings
-        embeddings = self.embeddings.encode_documents(documents)
-        
-        # Generate unique IDs
-        ids = [str(uuid.uuid4()) for _ in documents]
-        
+        return self.ingest_documents(documents, metadatas)["ids"]
+    
+    def plan_new_documents(self,
+                            documents: List[str],
+                            metadatas: Optional[List[Dict]]) -> Tuple[List[str], List[int], List[Dict]]:
+        """
+        Content-hash IDs for every document, and the positions of those not
+        yet in the collection (first occurrence only).
+        """
         # Prepare metadata
         if metadatas is None:
             metadatas = [{"source": "manual", "type": "document"} for _ in documents]
         
-        # Add to ChromaDB
-        self.collection.add(
-            embeddings=embeddings.tolist(),
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
+        ids = [content_id(doc, str(meta.get("source", "manual"))) for doc, meta in zip(documents, metadatas)]
+        
+        existing = set()
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), 1000):
+            existing.update(self.collection.get(ids=unique_ids[start:start + 1000], include=[])["ids"])
+        
+        seen = set()
+        new_positions = []
+        for i, doc_id in enumerate(ids):
+            if doc_id in existing or doc_id in seen:
+                continue
+            seen.add(doc_id)
+            new_positions.append(i)
+        return ids, new_positions, metadatas
+    
+    def ingest_documents(self,
+                         documents: List[str],
+                         metadatas: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """
+        Add documents, skipping chunks that are already stored.
+        Only new chunks are encoded; returns an ingestion report.
+        """
+        if not documents:
+            return {"ids": [], "added": 0, "skipped_duplicates": 0, "seconds": 0.0}
+        
+        start_time = time.perf_counter()
+        ids, new_positions, metadatas = self.plan_new_documents(documents, metadatas)
+        logger.info(
+            f"Adding {len(new_positions)} of {len(documents)} documents to knowledge base "
+            f"({len(documents) - len(new_positions)} already stored)..."
         )
         
-        # Clear GPU cache
-        self.embeddings.clear_gpu_cache()
+        if new_positions:
+            new_documents = [documents[i] for i in new_positions]
+            
+            # Generate embeddings
+            embeddings = self.embeddings.encode_documents(new_documents)
+            
+            # Add to the vector store
+            self.collection.add(
+                embeddings=embeddings,
+                documents=new_documents,
+                metadatas=[metadatas[i] for i in new_positions],
+                ids=[ids[i] for i in new_positions]
+            )
+            
+            # Clear GPU cache
+            self.embeddings.clear_gpu_cache()
         
-        logger.info(f"Successfully added {len(documents)} documents")
+        logger.info(f"Successfully added {len(new_positions)} documents")
+        return {
+            "ids": ids,
+            "added": len(new_positions),
+            "skipped_duplicates": len(documents) - len(new_positions),
+            "seconds": round(time.perf_counter() - start_time, 3)
+        }
+    
+    def add_embedded_documents(self,
+                               documents: List[str],
+                               embeddings,
+                               metadatas: Optional[List[Dict]] = None) -> List[str]:
+        """Add documents whose embeddings were already computed; existing chunks are skipped."""
+        ids, new_positions, metadatas = self.plan_new_documents(documents, metadatas)
+        
+        # Add to the vector store
+        if new_positions:
+            self.collection.add(
+                embeddings=np.asarray(embeddings)[new_positions],
+                documents=[documents[i] for i in new_positions],
+                metadatas=[metadatas[i] for i in new_positions],
+                ids=[ids[i] for i in new_positions]
+            )
         return ids
     
-    def search_similar(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
+    def sync_source(self,
+                    source: str,
+                    documents: List[str],
+                    metadatas: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """
+        Make the stored chunks of `source` match `documents`.
+        Chunks are matched by content hash: new ones are encoded and added,
+        chunks no longer present are deleted, and unchanged chunks only get
+        their metadata (e.g. chunk_index) refreshed.
+        """
+        sync = SourceSync(self, source)
+        sync.add_batch(documents, metadatas)
+        return sync.finish()
+    
+    def search_similar(self,
+                       query: str,
+                       top_k: int = None,
+                       filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """Search for similar documents using Stella embeddings."""
-        top_k = top_k or KBConfig.TOP_K_RESULTS
-        
         logger.info(f"Searching for: '{query[:50]}...'")
         
-        # Encode query
-        query_embedding = self.embeddings.encode_query(query)
-        
-        # Search in ChromaDB
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"]
-        )
-        
-        # Format results with similarity scores
-        formatted_results = []
-        if results['documents'][0]:  # Check if any results
-            for i in range(len(results['documents'][0])):
-                distance = results['distances'][0][i]
-                similarity = 1 - distance  # Convert distance to similarity
-                
-                # Only include results above threshold
-                if similarity >= KBConfig.SIMILARITY_THRESHOLD:
-                    formatted_results.append({
-                        'document': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'similarity': similarity,
-                        'distance': distance
-                    })
+        formatted_results = self.search_many([query], top_k, filters)[0]
         
         logger.info(f"Found {len(formatted_results)} relevant documents")
         return formatted_results
     
+    def search_many(self,
+                    queries: List[str],
+                    top_k: int = None,
+                    filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once: one encoder pass for all
+        uncached queries, then one thresholded vector query (see
+        retrieve_by_embedding). `filters` scopes the search by metadata
+        inside the vector store (see build_where).
+        Returns one result list per query, in input order.
+        """
+        if not queries:
+            return []
+        where = build_where(filters)
+        
+        # Encode queries
+        query_embeddings = self.embeddings.encode_queries(queries)
+        
+        return self.retrieve_by_embedding(np.stack(query_embeddings), top_k, where)
+    
+    def retrieve_by_embedding(self,
+                              query_embeddings: np.ndarray,
+                              top_k: int = None,
+                              where: Optional[Dict[str, Any]] = None,
+                              threshold: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Up to top_k hits with similarity >= threshold per query, best first.
+        
+        The vector query returns ids and distances only; results come back
+        sorted, so thresholding them loses nothing. Documents and metadata
+        are then loaded for the hits that clear the threshold.
+        """
+        top_k = min(top_k or KBConfig.TOP_K_RESULTS, self.collection.count())
+        threshold = KBConfig.SIMILARITY_THRESHOLD if threshold is None else threshold
+        max_distance = 1 - threshold
+        
+        hits: List[List[Tuple[str, float]]] = [[] for _ in range(len(query_embeddings))]
+        if top_k > 0:
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                where=where,
+                include=["distances"]
+            )
+            hits = [
+                [(doc_id, d) for doc_id, d in zip(ids, distances) if d <= max_distance]
+                for ids, distances in zip(results["ids"], results["distances"])
+            ]
+        
+        # Payload for the selected hits only
+        selected = list(dict.fromkeys(doc_id for query_hits in hits for doc_id, _ in query_hits))
+        records = {}
+        if selected:
+            stored = self.collection.get(ids=selected, include=["documents", "metadatas"])
+            records = {
+                doc_id: (document, metadata)
+                for doc_id, document, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            }
+        
+        return [
+            [
+                {
+                    'document': records[doc_id][0],
+                    'metadata': records[doc_id][1],
+                    'similarity': 1 - distance,  # Convert distance to similarity
+                    'distance': distance
+                }
+                for doc_id, distance in query_hits if doc_id in records
+            ]
+            for query_hits in hits
+        ]
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get knowledge base statistics."""
         count = self.collection.count()
-        return {
+        stats = {
             "total_documents": count,
             "collection_name": KBConfig.COLLECTION_NAME,
             "embedding_model": KBConfig.EMBEDDING_MODEL,
-            "embedding_dimension": KBConfig.EMBEDDING_DIMENSION
+            "embedding_dimension": KBConfig.EMBEDDING_DIMENSION,
+            "vector_backend": self.backend,
+            "vector_store": self.collection.stats()
         }
+        if self.embeddings is not None:
+            stats["embedding_precision"] = self.embeddings.precision
+            stats["query_cache"] = self.embeddings.query_cache.stats()
+            if self.embeddings.document_store is not None:
+                stats["document_embedding_store"] = self.embeddings.document_store.stats()
+        return stats
     
     def reset_database(self):
         """Reset the entire knowledge base (use carefully!)."""
         logger.warning("Resetting knowledge base...")
-        self.client.delete_collection(KBConfig.COLLECTION_NAME)
-        self._init_collection()
-        logger.info("Knowledge base reset complete") 
\ No newline at end of file
+        self.collection.reset()
+        logger.info("Knowledge base reset complete")
+
+
+class SourceSync:
+    """
+    Incremental replacement of one source's chunks, fed batch by batch so
+    large documents never have to be held in memory at once.
+    Removed chunks are deleted in finish(), after the new ones are stored.
+    """
+    
+    def __init__(self, vector_db: LocalVectorDB, source: str):
+        self.vector_db = vector_db
+        self.source = source
+        self.start_time = time.perf_counter()
+        
+        stored = vector_db.collection.get(where={"source": source}, include=["metadatas"])
+        self.stored_metadata = dict(zip(stored["ids"], stored["metadatas"]))
+        
+        self.ids: List[str] = []
+        self._seen = set()
+        self.added = 0
+        self.unchanged = 0
+        self.metadata_updated = 0
+        self.skipped_duplicates = 0
+    
+    def add_batch(self, documents: List[str], metadatas: Optional[List[Dict]] = None):
+        if metadatas is None:
+            metadatas = [{"type": "document"} for _ in documents]
+        metadatas = [dict(meta, source=self.source) for meta in metadatas]
+        ids = [content_id(doc, self.source) for doc in documents]
+        self.ids.extend(ids)
+        
+        changed = []
+        new_positions = []
+        for i, doc_id in enumerate(ids):
+            if doc_id in self._seen:
+                self.skipped_duplicates += 1
+                continue
+            self._seen.add(doc_id)
+            if doc_id in self.stored_metadata:
+                self.unchanged += 1
+                if self.stored_metadata[doc_id] != metadatas[i]:
+                    changed.append(i)
+            else:
+                new_positions.append(i)
+        
+        if changed:
+            self.vector_db.collection.update(
+                ids=[ids[i] for i in changed],
+                metadatas=[metadatas[i] for i in changed]
+            )
+            self.metadata_updated += len(changed)
+        
+        if new_positions:
+            report = self.vector_db.ingest_documents(
+                [documents[i] for i in new_positions],
+                [metadatas[i] for i in new_positions]
+            )
+            self.added += report["added"]
+    
+    def finish(self) -> Dict[str, Any]:
+        removed = [doc_id for doc_id in self.stored_metadata if doc_id not in self._seen]
+        for start in range(0, len(removed), 1000):
+            self.vector_db.collection.delete(ids=removed[start:start + 1000])
+        
+        logger.info(
+            f"Synced '{self.source}': {self.added} added, {len(removed)} removed, "
+            f"{self.unchanged} unchanged ({self.metadata_updated} metadata updates)"
+        )
+        return {
+            "ids": self.ids,
+            "added": self.added,
+            "removed": len(removed),
+            "unchanged": self.unchanged,
+            "metadata_updated": self.metadata_updated,
+            "skipped_duplicates": self.skipped_duplicates,
+            "seconds": round(time.perf_counter() - self.start_time, 3)
+        }
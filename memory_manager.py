@@ -0,0 +1,179 @@
+"""
+Memory-pressure-driven garbage collection
+Samples process RSS and the CUDA caching allocator and only runs
+gc.collect() / torch.cuda.empty_cache() when configured thresholds are
+crossed, recording how long each collection took
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_MB = 1024 * 1024
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (0 if it cannot be determined)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return 0
+
+
+class MemoryManager:
+    """
+    Decides when collection is worth its cost:
+    - gc.collect() when RSS has grown by ``rss_growth_mb`` since the last
+      collection, or is above the RSS threshold and higher than right after
+      the last collection (a collection that freed nothing is not repeated
+      until memory grows again)
+    - torch.cuda.empty_cache() when the allocator holds more than
+      ``cuda_slack_mb`` reserved-but-unused memory
+    Neither runs more often than every ``min_interval_s`` seconds.
+
+    The RSS threshold is ``rss_threshold_mb`` if given, otherwise
+    ``rss_headroom_mb`` above the baseline recorded by set_baseline() once
+    the model is loaded and warmed up (no threshold until then).
+    """
+
+    def __init__(self, rss_threshold_mb: Optional[float] = None, rss_headroom_mb: float = 512,
+                 rss_growth_mb: float = 256, cuda_slack_mb: float = 512, min_interval_s: float = 5.0):
+        self.fixed_threshold = rss_threshold_mb is not None
+        self.rss_threshold = int(rss_threshold_mb * _MB) if self.fixed_threshold else 0
+        self.rss_headroom = int(rss_headroom_mb * _MB)
+        self.rss_baseline = 0
+        self.rss_growth = int(rss_growth_mb * _MB)
+        self.cuda_slack = int(cuda_slack_mb * _MB)
+        self.min_interval_s = min_interval_s
+        self._lock = threading.Lock()
+
+        self._rss_after_collect = current_rss_bytes()
+        self._last_gc = 0.0
+        self._last_cuda = 0.0
+
+        self.checks = 0
+        self.gc_runs = 0
+        self.gc_seconds = 0.0
+        self.cuda_runs = 0
+        self.cuda_seconds = 0.0
+        self.recent = deque(maxlen=20)
+
+    def sample(self) -> Dict[str, int]:
+        sample = {"rss_bytes": current_rss_bytes()}
+        import torch
+        if torch.cuda.is_available():
+            sample["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+            sample["cuda_reserved_bytes"] = torch.cuda.memory_reserved()
+        return sample
+
+    def _run_gc(self, reason: str, before: Dict[str, int]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        collected = gc.collect()
+        elapsed = time.perf_counter() - started
+        rss_after = current_rss_bytes()
+        self._rss_after_collect = rss_after
+        self._last_gc = time.monotonic()
+        self.gc_runs += 1
+        self.gc_seconds += elapsed
+        event = {
+            "kind": "gc",
+            "reason": reason,
+            "objects": collected,
+            "ms": round(elapsed * 1000, 2),
+            "rss_before_mb": round(before["rss_bytes"] / _MB, 1),
+            "rss_after_mb": round(rss_after / _MB, 1),
+        }
+        self.recent.append(event)
+        return event
+
+    def _run_cuda(self, reason: str, before: Dict[str, int]) -> Dict[str, Any]:
+        import torch
+        started = time.perf_counter()
+        torch.cuda.empty_cache()
+        elapsed = time.perf_counter() - started
+        self._last_cuda = time.monotonic()
+        self.cuda_runs += 1
+        self.cuda_seconds += elapsed
+        event = {
+            "kind": "cuda_empty_cache",
+            "reason": reason,
+            "ms": round(elapsed * 1000, 2),
+            "reserved_before_mb": round(before["cuda_reserved_bytes"] / _MB, 1),
+            "reserved_after_mb": round(torch.cuda.memory_reserved() / _MB, 1),
+        }
+        self.recent.append(event)
+        return event
+
+    def maybe_collect(self, reason: str = "check") -> Optional[Dict[str, Any]]:
+        """Collect only if a threshold is crossed; returns what ran, if anything"""
+        with self._lock:
+            self.checks += 1
+            now = time.monotonic()
+            before = self.sample()
+            events = []
+
+            rss = before["rss_bytes"]
+            over_threshold = self.rss_threshold and rss > max(self.rss_threshold, self._rss_after_collect)
+            grew = self.rss_growth and rss - self._rss_after_collect > self.rss_growth
+            if (over_threshold or grew) and now - self._last_gc >= self.min_interval_s:
+                events.append(self._run_gc(reason, before))
+
+            if "cuda_reserved_bytes" in before:
+                slack = before["cuda_reserved_bytes"] - before["cuda_allocated_bytes"]
+                if slack > self.cuda_slack and now - self._last_cuda >= self.min_interval_s:
+                    events.append(self._run_cuda(reason, before))
+
+            return {"events": events} if events else None
+
+    def collect(self, reason: str) -> Dict[str, Any]:
+        """Unconditional collection, e.g. around model load/unload"""
+        with self._lock:
+            before = self.sample()
+            events = [self._run_gc(reason, before)]
+            if "cuda_reserved_bytes" in before:
+                events.append(self._run_cuda(reason, before))
+            return {"events": events}
+
+    def set_baseline(self) -> int:
+        """
+        Record the current RSS as the loaded-and-warm baseline and, unless a
+        fixed threshold was configured, set the threshold to baseline +
+        headroom. Call right after the post-load collection.
+        """
+        with self._lock:
+            self.rss_baseline = current_rss_bytes()
+            if not self.fixed_threshold:
+                self.rss_threshold = self.rss_baseline + self.rss_headroom
+            return self.rss_threshold
+
+    def stats(self) -> Dict[str, Any]:
+        sample = self.sample()
+        with self._lock:
+            stats = {
+                "rss_mb": round(sample["rss_bytes"] / _MB, 1),
+                "rss_baseline_mb": round(self.rss_baseline / _MB, 1) if self.rss_baseline else None,
+                "rss_threshold_mb": round(self.rss_threshold / _MB, 1) if self.rss_threshold else None,
+                "rss_growth_mb": round(self.rss_growth / _MB, 1),
+                "checks": self.checks,
+                "gc_runs": self.gc_runs,
+                "gc_total_ms": round(self.gc_seconds * 1000, 2),
+                "cuda_empty_cache_runs": self.cuda_runs,
+                "cuda_empty_cache_total_ms": round(self.cuda_seconds * 1000, 2),
+                "recent": list(self.recent),
+            }
+            if "cuda_reserved_bytes" in sample:
+                stats["cuda_allocated_mb"] = round(sample["cuda_allocated_bytes"] / _MB, 1)
+                stats["cuda_reserved_mb"] = round(sample["cuda_reserved_bytes"] / _MB, 1)
+            return stats
@@ -4,12 +4,16 @@ Serverless TTS with automatic scaling and GPU support
 """
 
 import modal
-import io
 import base64
 import tempfile
 import os
 from typing import Optional
 
+from fastapi import Request
+from fastapi.responses import Response
+
+from tts_audio import AudioFormatError, encode_audio, normalize_format, uncompressed_size, wants_binary
+
 # Create Modal app
 app = modal.App("chatterbox-tts-api")
 
@@ -24,6 +28,7 @@ image = (
         "torch",
         "torchaudio", 
         "numpy",
+        "soundfile>=0.13.0",
         "pydantic>=2.0.0"
     ])
     .env({"PYTORCH_ENABLE_MPS_FALLBACK": "1"})
@@ -58,9 +63,17 @@ def generate_tts(
     exaggeration: float = 0.5,
     temperature: float = 0.8,
     cfg_weight: float = 0.5,
-    seed: int = 0
+    seed: int = 0,
+    response_format: Optional[str] = None,
+    format: str = "wav",
+    bitrate: Optional[int] = None,
+    request: Request = None
 ):
-    """🎤 Generate TTS audio (JSON endpoint)"""
+    """
+    🎤 Generate TTS audio
+    Returns audio/wav bytes when asked for (Accept: audio/* or
+    response_format=binary), base64 JSON otherwise
+    """
     
     # Input validation
     if not text or len(text.strip()) == 0:
@@ -69,6 +82,11 @@ def generate_tts(
     if len(text) > 500:
         return {"error": "Text must be 500 characters or less"}, 400
     
+    try:
+        format = normalize_format(format)
+    except AudioFormatError as e:
+        return {"error": str(e)}, 400
+    
     try:
         # Load model (cached after first call)
         model = load_model()
@@ -90,18 +108,30 @@ def generate_tts(
                 cfg_weight=cfg_weight
             )
         
-        # Convert to base64
-        import torchaudio as ta
-        audio_buffer = io.BytesIO()
-        ta.save(audio_buffer, wav, model.sr, format="wav")
-        audio_bytes = audio_buffer.getvalue()
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+        # Convert to bytes in the requested codec
+        audio_bytes, media_type, bitrate_used = encode_audio(wav, model.sr, format, bitrate)
+        bytes_saved = max(0, uncompressed_size(wav) - len(audio_bytes))
         
         print("✅ TTS generation successful!")
         
+        accept = request.headers.get("accept", "") if request is not None else ""
+        if wants_binary(accept, response_format):
+            headers = {
+                "X-Sample-Rate": str(model.sr),
+                "X-Audio-Format": format,
+                "X-Audio-Bytes-Saved": str(bytes_saved)
+            }
+            if bitrate_used:
+                headers["X-Audio-Bitrate"] = f"{bitrate_used}k"
+            return Response(content=audio_bytes, media_type=media_type, headers=headers)
+        
+        # Legacy clients: base64 inside JSON
+        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
         return {
             "audio_base64": audio_base64,
             "sample_rate": model.sr,
+            "format": format,
+            "bytes_saved": bytes_saved,
             "message": "TTS generation successful"
         }
         
@@ -1,8 +1,10 @@
 import openai
 from openai import OpenAI
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import time
 from kb_config import KBConfig
-from local_vector_db import LocalVectorDB
+from local_vector_db import LocalVectorDB, build_where
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,21 +20,70 @@ class LocalRAGService:
         # Initialize local vector database
         self.vector_db = LocalVectorDB()
         
+        # Optional cross-encoder reranking stage
+        self.reranker = None
+        if KBConfig.RERANK_ENABLED:
+            try:
+                from reranker import CrossEncoderReranker
+                self.reranker = CrossEncoderReranker()
+            except Exception as e:
+                logger.warning(f"Reranker unavailable, using bi-encoder ranking only: {e}")
+        
         logger.info("RAG service initialized successfully")
     
+    def retrieve(self,
+                 query: str,
+                 top_k: Optional[int] = None,
+                 filters: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Context documents for `query` and per-stage timings (ms).
+        With a reranker, a wider bi-encoder candidate set is reranked by the
+        cross-encoder; otherwise the bi-encoder top_k is returned as is.
+        """
+        top_k = top_k or KBConfig.TOP_K_RESULTS
+        where = build_where(filters)
+        n_candidates = max(top_k, KBConfig.RERANK_CANDIDATES) if self.reranker else top_k
+        
+        start = time.perf_counter()
+        query_embedding = self.vector_db.embeddings.encode_query(query)
+        embedded = time.perf_counter()
+        candidates = self.vector_db.retrieve_by_embedding(np.stack([query_embedding]), n_candidates, where)[0]
+        searched = time.perf_counter()
+        
+        timings: Dict[str, Any] = {
+            "embed_ms": round((embedded - start) * 1000, 1),
+            "search_ms": round((searched - embedded) * 1000, 1),
+            "candidates": len(candidates),
+        }
+        if self.reranker is not None:
+            documents, rerank_timing = self.reranker.rerank(query, candidates, top_k)
+            timings["rerank_ms"] = rerank_timing["rerank_ms"]
+            timings["reranked"] = rerank_timing["reranked"]
+            if "fallback" in rerank_timing:
+                timings["rerank_fallback"] = rerank_timing["fallback"]
+        else:
+            documents = candidates[:top_k]
+        timings["retrieval_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        
+        logger.info(f"Retrieved {len(documents)} documents: {timings}")
+        return documents, timings
+    
     def generate_response(self, 
                          user_query: str, 
-                         conversation_history: Optional[List[Dict]] = None) -> Dict[str, Any]:
+                         conversation_history: Optional[List[Dict]] = None,
+                         filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Generate intelligent response using RAG (Retrieval-Augmented Generation).
         Perfect for integration with your voice cloning system.
+        `filters` restricts retrieval by source, type or upload_type.
         """
         logger.info(f"Processing query: '{user_query}'")
         
         # 1. Retrieve relevant knowledge
-        relevant_docs = self.vector_db.search_similar(
+        relevant_docs, timings = self.retrieve(
             user_query, 
-            top_k=KBConfig.TOP_K_RESULTS
+            top_k=KBConfig.TOP_K_RESULTS,
+            filters=filters
         )
         
         # 2. Prepare context from retrieved documents
@@ -72,6 +123,7 @@ INSTRUCTIONS:
         
         # 4. Generate response with OpenAI
         try:
+            generation_start = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=KBConfig.OPENAI_MODEL,
                 messages=messages,
@@ -82,6 +134,7 @@ INSTRUCTIONS:
             
             ai_response = response.choices[0].message.content.strip()
             tokens_used = response.usage.total_tokens
+            timings["generation_ms"] = round((time.perf_counter() - generation_start) * 1000, 1)
             
             logger.info(f"Generated response ({tokens_used} tokens)")
             
@@ -90,6 +143,7 @@ INSTRUCTIONS:
                 "sources": relevant_docs,
                 "tokens_used": tokens_used,
                 "model_used": KBConfig.OPENAI_MODEL,
+                "timings": timings,
                 "success": True
             }
             
@@ -100,21 +154,28 @@ INSTRUCTIONS:
                 "sources": [],
                 "tokens_used": 0,
                 "model_used": None,
+                "timings": timings,
                 "success": False
             }
     
     def add_knowledge(self, 
                      documents: List[str], 
                      metadatas: Optional[List[Dict]] = None) -> Dict[str, Any]:
-        """Add new documents to the local knowledge base."""
+        """
+        Add new documents to the local knowledge base.
+        Chunks already stored (same source and text) are skipped.
+        """
         try:
-            doc_ids = self.vector_db.add_documents(documents, metadatas)
+            report = self.vector_db.ingest_documents(documents, metadatas)
             stats = self.vector_db.get_stats()
             
             return {
                 "success": True,
-                "message": f"Successfully added {len(doc_ids)} documents",
-                "document_ids": doc_ids,
+                "message": f"Successfully added {report['added']} documents "
+                           f"({report['skipped_duplicates']} duplicates skipped)",
+                "document_ids": report["ids"],
+                "added": report["added"],
+                "skipped_duplicates": report["skipped_duplicates"],
                 "knowledge_base_stats": stats
             }
             
@@ -124,5 +185,46 @@ INSTRUCTIONS:
                 "success": False,
                 "message": f"Failed to add documents: {str(e)}",
                 "document_ids": [],
+                "added": 0,
+                "skipped_duplicates": 0,
+                "knowledge_base_stats": {}
+            }
+    
+    def sync_knowledge(self,
+                       source: str,
+                       documents: List[str],
+                       metadatas: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """
+        Replace the knowledge from one source, re-embedding only chunks
+        that are new or changed and deleting chunks that were removed.
+        """
+        try:
+            report = self.vector_db.sync_source(source, documents, metadatas)
+            stats = self.vector_db.get_stats()
+            
+            return {
+                "success": True,
+                "message": f"Synced {source}: {report['added']} added, {report['removed']} removed, "
+                           f"{report['unchanged']} unchanged",
+                "document_ids": report["ids"],
+                "added": report["added"],
+                "removed": report["removed"],
+                "unchanged": report["unchanged"],
+                "metadata_updated": report["metadata_updated"],
+                "skipped_duplicates": report["skipped_duplicates"],
+                "knowledge_base_stats": stats
+            }
+            
+        except Exception as e:
+            logger.error(f"Error syncing knowledge: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Failed to sync documents: {str(e)}",
+                "document_ids": [],
+                "added": 0,
+                "removed": 0,
+                "unchanged": 0,
+                "metadata_updated": 0,
+                "skipped_duplicates": 0,
                 "knowledge_base_stats": {}
-            } 
\ No newline at end of file
+            }
@@ -0,0 +1,86 @@
+"""
+Cross-encoder reranking of retrieved chunks.
+
+A cross-encoder reads the query and a passage together, so it ranks
+better than comparing precomputed embeddings, but it has to run once per
+(query, passage) pair. It is therefore applied only to a short list of
+bi-encoder hits, in small batches, under a latency budget: if the budget
+runs out the bi-encoder order is kept, so a slow moment costs ranking
+quality, not response time.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from kb_config import KBConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    def __init__(self,
+                 model_name: Optional[str] = None,
+                 device: Optional[str] = None,
+                 batch_size: Optional[int] = None,
+                 max_length: Optional[int] = None,
+                 budget_ms: Optional[float] = None):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name or KBConfig.RERANKER_MODEL
+        self.device = device or KBConfig.RERANKER_DEVICE
+        self.batch_size = batch_size or KBConfig.RERANK_BATCH_SIZE
+        self.budget_ms = KBConfig.RERANK_BUDGET_MS if budget_ms is None else budget_ms
+
+        start = time.perf_counter()
+        self.model = CrossEncoder(
+            self.model_name,
+            device=self.device,
+            max_length=max_length or KBConfig.RERANK_MAX_LENGTH
+        )
+        # First call pays for lazy initialisation; keep it out of requests
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        logger.info(
+            f"Reranker {self.model_name} loaded on {self.device} in "
+            f"{time.perf_counter() - start:.1f}s (budget {self.budget_ms:.0f} ms)"
+        )
+
+    def rerank(self,
+               query: str,
+               candidates: List[Dict[str, Any]],
+               top_k: int,
+               budget_ms: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Best `top_k` of `candidates` (bi-encoder results, best first) by
+        cross-encoder score, each with a 'rerank_score'. Batches are scored
+        while the next one is expected to fit in the budget (judging by the
+        last batch); otherwise the first `top_k` candidates are returned
+        unchanged. Returns (results, timing).
+        """
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        timing: Dict[str, Any] = {"candidates": len(candidates), "reranked": False}
+        if len(candidates) <= 1:
+            timing["rerank_ms"] = 0.0
+            return candidates[:top_k], timing
+
+        start = time.perf_counter()
+        pairs = [(query, candidate["document"]) for candidate in candidates]
+        scores: List[float] = []
+        batch_ms = 0.0
+        for offset in range(0, len(pairs), self.batch_size):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if offset and elapsed_ms + batch_ms > budget_ms:
+                timing.update({
+                    "rerank_ms": round(elapsed_ms, 1),
+                    "fallback": f"budget of {budget_ms:.0f} ms would be exceeded after {offset} of {len(pairs)} pairs",
+                })
+                logger.warning(f"Reranking {timing['fallback']}; keeping bi-encoder order")
+                return candidates[:top_k], timing
+            batch = pairs[offset:offset + self.batch_size]
+            batch_start = time.perf_counter()
+            scores.extend(self.model.predict(batch, batch_size=len(batch), show_progress_bar=False).tolist())
+            batch_ms = (time.perf_counter() - batch_start) * 1000
+
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda pair: -pair[0])[:top_k]
+        results = [dict(candidates[i], rerank_score=float(score)) for score, i in ranked]
+        timing.update({"reranked": True, "rerank_ms": round((time.perf_counter() - start) * 1000, 1)})
+        return results, timing
@@ -1,8 +1,11 @@
 import torch
 from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Dense
 import numpy as np
-from typing import List
+import time
+from typing import List, Optional
 from kb_config import KBConfig
+from embedding_cache import DocumentEmbeddingStore, QueryEmbeddingCache
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -23,49 +26,256 @@ class StellaEmbeddingService:
         
         # Configure for optimal performance
         self.model.max_seq_length = 512
-        logger.info("Stella model loaded successfully")
+        
+        # Project to the Matryoshka dimension inside the output head, then
+        # switch precision, so the unused tail is never computed
+        self.dimension = KBConfig.EMBEDDING_DIMENSION
+        self.head_truncated = self._truncate_output_head(self.dimension)
+        self.precision = self._apply_precision(KBConfig.EMBEDDING_PRECISION)
+        self.token_budget = self._resolve_token_budget(KBConfig.EMBEDDING_TOKEN_BUDGET)
+        
+        self.query_cache = QueryEmbeddingCache(
+            KBConfig.EMBEDDING_MODEL,
+            self.dimension,
+            self.precision,
+            max_entries=KBConfig.QUERY_CACHE_SIZE,
+            db_path=KBConfig.QUERY_CACHE_PATH,
+            max_disk_entries=KBConfig.QUERY_CACHE_DISK_ENTRIES
+        )
+        self.document_store = None
+        if KBConfig.DOCUMENT_EMBEDDING_STORE_PATH:
+            self.document_store = DocumentEmbeddingStore(
+                KBConfig.EMBEDDING_MODEL,
+                self.dimension,
+                self.precision,
+                KBConfig.DOCUMENT_EMBEDDING_STORE_PATH
+            )
+        logger.info(
+            f"Stella model loaded successfully "
+            f"(precision={self.precision}, dim={self.dimension}, head_truncated={self.head_truncated}, "
+            f"token_budget={self.token_budget})"
+        )
+    
+    def _truncate_output_head(self, dim: int) -> bool:
+        """
+        Keep only the first `dim` rows of the final Dense projection.
+        Matryoshka embeddings are prefix-truncatable, so this yields exactly
+        the first `dim` components of the full-width output.
+        """
+        dense_layers = [module for module in self.model if isinstance(module, Dense)]
+        if not dense_layers:
+            return False
+        
+        linear = dense_layers[-1].linear
+        if linear.out_features <= dim:
+            return linear.out_features == dim
+        
+        with torch.no_grad():
+            # clone() so the full-width weight can be freed
+            linear.weight = torch.nn.Parameter(linear.weight[:dim].clone(), requires_grad=False)
+            if linear.bias is not None:
+                linear.bias = torch.nn.Parameter(linear.bias[:dim].clone(), requires_grad=False)
+        linear.out_features = dim
+        dense_layers[-1].out_features = dim
+        return True
+    
+    def _apply_precision(self, precision: str) -> str:
+        """Cast or quantize the model; returns the precision actually in use"""
+        if precision == "auto":
+            if self.device == "cuda":
+                precision = "bf16" if torch.cuda.is_bf16_supported() else "fp16"
+            else:
+                precision = "fp32"
+        
+        if precision == "int8":
+            if self.device != "cpu":
+                logger.warning("int8 dynamic quantization is CPU only, using fp16")
+                precision = "fp16"
+            else:
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                return precision
+        
+        if precision == "fp16" and self.device == "cpu":
+            # Half-precision matmuls are slow or missing on most CPUs
+            logger.warning("fp16 is not well supported on CPU, using bf16")
+            precision = "bf16"
+        
+        dtypes = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+        if precision not in dtypes:
+            logger.warning(f"Unknown EMBEDDING_PRECISION '{precision}', using fp32")
+            precision = "fp32"
+        if precision != "fp32":
+            self.model.to(dtypes[precision])
+        return precision
+    
+    def _resolve_token_budget(self, budget) -> int:
+        """
+        Padded tokens per batch. "auto" scales with the hardware: roughly 4k
+        tokens per free GB on GPU, 512 tokens per intra-op thread on CPU.
+        """
+        if str(budget).lower() != "auto":
+            try:
+                return max(self.model.max_seq_length, int(budget))
+            except ValueError:
+                logger.warning(f"Invalid EMBEDDING_TOKEN_BUDGET '{budget}', using auto")
+        
+        if self.device == "cuda":
+            free_bytes, _ = torch.cuda.mem_get_info()
+            budget = int(free_bytes / 1024 ** 3 * 4096)
+        else:
+            budget = torch.get_num_threads() * 512
+        return min(max(budget, self.model.max_seq_length), 65536)
+    
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """Token count of each text after truncation to max_seq_length."""
+        encoded = self.model.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+    
+    def _token_budget_batches(self, lengths: np.ndarray, token_budget: int) -> List[np.ndarray]:
+        """
+        Sort by length (longest first) and cut batches so that
+        batch size * longest item stays within the token budget.
+        """
+        order = np.argsort(-lengths, kind="stable")
+        batches = []
+        start = 0
+        while start < len(order):
+            # Longest item of the batch sets the padded width
+            width = max(int(lengths[order[start]]), 1)
+            size = min(max(token_budget // width, 1), KBConfig.EMBEDDING_MAX_BATCH_SIZE)
+            batches.append(order[start:start + size])
+            start += size
+        return batches
+    
+    def _encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Encode, cut to the configured dimension and L2-normalize"""
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
+                normalize_embeddings=False,
+                convert_to_tensor=True,
+                **kwargs
+            )
+        # Reduced-precision outputs are upcast once, at the target width
+        embeddings = embeddings[:, :self.dimension].float().cpu().numpy()
+        
+        # Normalize after truncation so the stored vectors are unit length
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.maximum(norms, 1e-12, out=norms)
+        embeddings /= norms
+        return embeddings
     
-    def encode_documents(self, texts: List[str]) -> np.ndarray:
+    def encode_documents(self, texts: List[str], token_budget: Optional[int] = None) -> np.ndarray:
         """
         Encode documents for storage in knowledge base.
         Uses s2p (search to passage) prompt format.
+        Texts already in the document embedding store are not re-encoded.
+        The rest are grouped by token length into batches that fit the token
+        budget, so short passages are not padded to a long neighbour; the
+        result is returned in input order.
         """
         if not texts:
             return np.array([])
         
-        logger.info(f"Encoding {len(texts)} documents...")
+        if self.document_store is None:
+            return self._encode_passages(texts, token_budget)
         
-        # For documents, we don't need special formatting - they are the passages
-        embeddings = self.model.encode(
-            texts,
-            normalize_embeddings=True,
-            convert_to_numpy=True,
-            batch_size=8,  # Conservative batch size for local deployment
-            show_progress_bar=True
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        stored = self.document_store.get_many(texts)
+        for i, vector in stored.items():
+            embeddings[i] = vector
+        
+        # Encode each distinct missing text once
+        missing = {}
+        for i, text in enumerate(texts):
+            if i not in stored:
+                missing.setdefault(text, []).append(i)
+        if missing:
+            unique_texts = list(missing)
+            encoded = self._encode_passages(unique_texts, token_budget)
+            self.document_store.put_many(unique_texts, encoded)
+            for text, vector in zip(unique_texts, encoded):
+                embeddings[missing[text]] = vector
+        
+        logger.info(f"Document embeddings: {len(stored)} from store, {len(missing)} encoded")
+        return embeddings
+    
+    def _encode_passages(self, texts: List[str], token_budget: Optional[int] = None) -> np.ndarray:
+        """Run the encoder over passages in token-budgeted, length-sorted batches."""
+        token_budget = token_budget or self.token_budget
+        lengths = self._token_lengths(texts)
+        batches = self._token_budget_batches(lengths, token_budget)
+        logger.info(
+            f"Encoding {len(texts)} documents ({int(lengths.sum())} tokens) "
+            f"in {len(batches)} batches, budget {token_budget} tokens..."
         )
         
-        # Use Matryoshka dimension truncation
-        embeddings = embeddings[:, :KBConfig.EMBEDDING_DIMENSION]
+        start_time = time.perf_counter()
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for batch_number, indices in enumerate(batches, 1):
+            # For documents, we don't need special formatting - they are the passages
+            embeddings[indices] = self._encode(
+                [texts[i] for i in indices],
+                batch_size=len(indices),
+                show_progress_bar=False
+            )
+            if batch_number % 10 == 0:
+                logger.info(f"Encoded {batch_number}/{len(batches)} batches")
         
-        logger.info(f"Generated embeddings shape: {embeddings.shape}")
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"Generated embeddings shape: {embeddings.shape} in {elapsed:.2f}s "
+            f"({len(texts) / max(elapsed, 1e-9):.1f} docs/s)"
+        )
         return embeddings
     
+    @staticmethod
+    def _format_query(query: str) -> str:
+        # Stella's recommended s2p_query prompt for search queries
+        return f"Instruct: Given a web search query, retrieve relevant passages that answer the query.\nQuery: {query}"
+    
     def encode_query(self, query: str) -> np.ndarray:
         """
         Encode user query for retrieval.
         Uses s2s (search to search) prompt format.
+        Repeated queries are served from the query cache without the encoder.
+        The returned vector is shared and read-only.
+        """
+        return self.encode_queries([query])[0]
+    
+    def encode_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """
+        Encode many queries; cache misses share a single forward pass.
+        Returns one shared, read-only vector per query, in input order.
         """
-        # Format with Stella's recommended s2p_query prompt for search queries
-        formatted_query = f"Instruct: Given a web search query, retrieve relevant passages that answer the query.\nQuery: {query}"
+        embeddings: List[Optional[np.ndarray]] = [self.query_cache.get(query) for query in queries]
         
-        embedding = self.model.encode(
-            [formatted_query],
-            normalize_embeddings=True,
-            convert_to_numpy=True
-        )
+        # Encode each distinct uncached query once
+        missing = {}
+        for i, query in enumerate(queries):
+            if embeddings[i] is None:
+                missing.setdefault(query, []).append(i)
         
-        # Truncate to configured dimension
-        return embedding[0][:KBConfig.EMBEDDING_DIMENSION]
+        if missing:
+            unique_queries = list(missing)
+            encoded = self._encode(
+                [self._format_query(query) for query in unique_queries],
+                batch_size=max(1, len(unique_queries))
+            )
+            for query, vector in zip(unique_queries, encoded):
+                cached = self.query_cache.put(query, vector)
+                for i in missing[query]:
+                    embeddings[i] = cached
+        
+        return embeddings
     
     def clear_gpu_cache(self):
         """Clear GPU cache to free memory."""
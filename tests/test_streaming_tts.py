@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test the streaming TTS endpoint: time to first audio vs. total time
+"""
+
+import time
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+LONG_TEXT = (
+    "Streaming lets the listener start hearing the answer right away. "
+    "Each sentence is synthesized on its own and sent as soon as it is ready. "
+    "Meanwhile the next sentence is already being generated in the background. "
+    "This text is longer than the five hundred character limit of the regular endpoint, "
+    "which would reject it outright. "
+) * 3
+
+def test_streaming_tts():
+    """Stream a long text and report time to first audio"""
+    print("🧪 Testing streaming TTS...")
+    print(f"📝 Text length: {len(LONG_TEXT)} characters")
+
+    start_time = time.time()
+    first_chunk_time = None
+    total_bytes = 0
+
+    with requests.post(f"{BASE_URL}/tts-stream", json={"text": LONG_TEXT, "seed": 42}, stream=True) as response:
+        if response.status_code != 200:
+            print(f"❌ Streaming failed: {response.status_code} {response.text}")
+            return False
+
+        sample_rate = int(response.headers["X-Sample-Rate"])
+        print(f"📊 Sample rate: {sample_rate} Hz, segments: {response.headers.get('X-Segments')}")
+
+        with open("stream_test_output.wav", "wb") as f:
+            for chunk in response.iter_content(chunk_size=None):
+                if not chunk:
+                    continue
+                # The first chunk is only the 44-byte WAV header
+                if first_chunk_time is None and total_bytes >= 44:
+                    first_chunk_time = time.time() - start_time
+                total_bytes += len(chunk)
+                f.write(chunk)
+
+    total_time = time.time() - start_time
+    audio_seconds = (total_bytes - 44) / (2 * sample_rate)
+    print(f"⏱️  Time to first audio: {first_chunk_time:.2f}s")
+    print(f"⏱️  Total time: {total_time:.2f}s for {audio_seconds:.1f}s of audio")
+    print("💾 Audio saved to: stream_test_output.wav")
+    return True
+
+if __name__ == "__main__":
+    print("Make sure the API server is running: python3 api_server.py")
+    print("-" * 50)
+    test_streaming_tts()
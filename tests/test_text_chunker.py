@@ -0,0 +1,59 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from text_chunker import TokenChunker
+
+# GPT-2 style pre-tokenization: like Stella's byte-level BPE tokenizer, every
+# word token keeps its leading space (" Next") and offsets are not trimmed
+_BYTE_LEVEL = re.compile(r" ?[A-Za-z0-9]+| ?[^\sA-Za-z0-9]+|\s+(?!\S)|\s+")
+
+
+class ByteLevelTokenizer:
+    def __call__(self, text, **kwargs):
+        return {"offset_mapping": [m.span() for m in _BYTE_LEVEL.finditer(text)]}
+
+
+def _document(paragraphs=40, sentences=6, edited=None):
+    out = []
+    for p in range(paragraphs):
+        text = " ".join(f"Sentence number {p}-{s} has a few words in it." for s in range(sentences))
+        if p == edited:
+            text += " One more sentence was added here."
+        out.append(text)
+    return "\n\n".join(out)
+
+
+def test_chunks_start_at_sentence_starts():
+    chunker = TokenChunker(ByteLevelTokenizer(), max_tokens=40, overlap_tokens=0, min_tokens=1)
+    for chunk in chunker.chunk_text(_document()):
+        assert chunk.startswith("Sentence number"), chunk[:40]
+        assert chunk.endswith("in it."), chunk[-40:]
+    print("✅ Chunks start and end on sentence boundaries")
+
+
+def test_edit_only_rechunks_its_paragraph():
+    chunker = TokenChunker(ByteLevelTokenizer(), max_tokens=60, overlap_tokens=12, min_tokens=1)
+    before = chunker.chunk_text(_document())
+    after = chunker.chunk_text(_document(edited=3))
+    changed = set(after) - set(before)
+    assert changed and all("3-" in chunk for chunk in changed), changed
+    print(f"✅ Editing one paragraph changed {len(changed)} of {len(after)} chunks")
+
+
+def test_streaming_matches_whole_document():
+    text = _document(paragraphs=200) + "\n\n" + "x" * 5 + " word" * 300 + "."
+    whole = TokenChunker(ByteLevelTokenizer(), max_tokens=50, overlap_tokens=8, min_tokens=1)
+    streamed = TokenChunker(ByteLevelTokenizer(), max_tokens=50, overlap_tokens=8, min_tokens=1)
+    blocks = [text[i:i + 997] for i in range(0, len(text), 997)]
+    assert list(streamed.iter_chunks(blocks)) == whole.chunk_text(text)
+    assert streamed.stats()["hard_splits"] == whole.stats()["hard_splits"] > 0
+    print("✅ Streamed chunking matches whole-document chunking, hard splits counted once")
+
+
+if __name__ == "__main__":
+    test_chunks_start_at_sentence_starts()
+    test_edit_only_rechunks_its_paragraph()
+    test_streaming_matches_whole_document()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test registered voice profiles: upload a clip once, then synthesize by voice_id
+Usage: python3 tests/test_voice_registry.py path/to/reference.wav
+"""
+
+import sys
+import time
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+def run_voice_registry_test(reference_path):
+    """Register a voice and reuse it without re-uploading"""
+    print("🧪 Testing voice registry...")
+
+    # 1. Register the reference clip
+    print("\n1. Registering reference clip...")
+    with open(reference_path, "rb") as f:
+        response = requests.post(
+            f"{BASE_URL}/voices",
+            files={"audio_file": (reference_path, f, "audio/wav")},
+            data={"name": "registry-test"}
+        )
+    if response.status_code != 200:
+        print(f"❌ Registration failed: {response.status_code} {response.text}")
+        return False
+    voice = response.json()
+    voice_id = voice["voice_id"]
+    print(f"✅ Registered voice_id={voice_id} ({voice['profile_bytes']} bytes on disk)")
+
+    # 2. Registering the same clip again should return the same id
+    print("\n2. Re-registering the same clip...")
+    with open(reference_path, "rb") as f:
+        response = requests.post(f"{BASE_URL}/voices", files={"audio_file": (reference_path, f, "audio/wav")})
+    if response.json().get("voice_id") != voice_id:
+        print("❌ Same clip produced a different voice_id")
+        return False
+    print("✅ Registration is idempotent")
+
+    # 3. Synthesize with the voice_id only
+    print("\n3. Generating TTS by voice_id...")
+    start_time = time.time()
+    response = requests.post(f"{BASE_URL}/tts", json={
+        "text": "This voice was registered once and reused by id.",
+        "voice_id": voice_id
+    })
+    if response.status_code != 200:
+        print(f"❌ TTS by voice_id failed: {response.status_code} {response.text}")
+        return False
+    print(f"✅ Generated in {time.time() - start_time:.2f}s: {response.json()['message']}")
+
+    # 4. Unknown voice ids are rejected
+    print("\n4. Checking unknown voice_id...")
+    response = requests.post(f"{BASE_URL}/tts", json={"text": "Hello", "voice_id": "0" * 32})
+    if response.status_code != 404:
+        print(f"❌ Expected 404 for unknown voice_id, got {response.status_code}")
+        return False
+    print("✅ Unknown voice_id returns 404")
+
+    # 5. Listing and cleanup
+    voices = requests.get(f"{BASE_URL}/voices").json()["voices"]
+    print(f"\n5. {len(voices)} registered voice(s)")
+    response = requests.delete(f"{BASE_URL}/voices/{voice_id}")
+    print(f"🧹 Delete: {response.status_code}")
+    if response.status_code != 200:
+        return False
+
+    # 6. A deleted voice is gone, even while its conditionals were cached
+    response = requests.post(f"{BASE_URL}/tts", json={
+        "text": "This voice was registered once and reused by id.",
+        "voice_id": voice_id
+    })
+    if response.status_code != 404:
+        print(f"❌ Expected 404 for deleted voice_id, got {response.status_code}")
+        return False
+    print("✅ Deleted voice_id returns 404")
+    return True
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 tests/test_voice_registry.py path/to/reference.wav")
+        sys.exit(1)
+    success = run_voice_registry_test(sys.argv[1])
+    print("\n🎉 Voice registry test passed!" if success else "\n❌ Voice registry test failed")
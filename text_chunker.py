@@ -0,0 +1,188 @@
+"""
+Token-aware chunking for the knowledge base.
+
+Text is tokenized once with offsets, sentence boundaries are mapped onto
+token positions, and sentences are packed greedily into chunks of at most
+`max_tokens` tokens with `overlap_tokens` of sentence-aligned overlap.
+Packing restarts at every paragraph (blank line) or page break and never
+spans one, so chunk boundaries follow the content: editing a paragraph
+only re-chunks that paragraph. Sentences longer than the budget are cut
+at the budget, so nothing is silently truncated by the encoder's
+max_seq_length.
+"""
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from kb_config import KBConfig
+
+# Sentence end (optionally followed by closing quotes/brackets) before whitespace;
+# the break is where the whitespace starts, since byte-level BPE tokenizers
+# keep the leading space in the next token (" Next")
+_SENTENCE_BREAK = re.compile(r'[.!?…]["\')\]]*(?=\s)')
+# Blank line: paragraph or page break (pages are joined with "\n\n")
+_PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n\s*')
+
+HISTOGRAM_BINS = [0, 32, 64, 128, 256, 384, 512, 1 << 30]
+
+# Characters of text handed to the tokenizer at once when streaming
+WINDOW_CHUNKS = 8
+CHARS_PER_TOKEN = 4
+
+
+def load_tokenizer(model_name: Optional[str] = None):
+    """The embedding model's tokenizer, without loading the model weights."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name or KBConfig.EMBEDDING_MODEL, trust_remote_code=True)
+
+
+class TokenChunker:
+    def __init__(self, tokenizer,
+                 max_tokens: Optional[int] = None,
+                 overlap_tokens: Optional[int] = None,
+                 min_tokens: Optional[int] = None,
+                 model_max_tokens: int = 512):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens or KBConfig.CHUNK_MAX_TOKENS
+        overlap = KBConfig.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        # Overlap must leave room for new content in every chunk
+        self.overlap_tokens = min(max(0, overlap), self.max_tokens // 2)
+        self.min_tokens = KBConfig.CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+        self.model_max_tokens = model_max_tokens
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._token_counts: List[int] = []
+        self.hard_splits = 0
+        self.dropped = 0
+
+    def _plan(self, text: str) -> Tuple[np.ndarray, List[Tuple[int, int]], np.ndarray]:
+        """
+        Token offsets of `text`, the (start, end) token span of every chunk,
+        and the token positions where over-long sentences were cut.
+        """
+        encoded = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            verbose=False
+        )
+        offsets = np.asarray(encoded["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+        n_tokens = len(offsets)
+        no_cuts = np.empty(0, dtype=np.int64)
+        if n_tokens == 0:
+            return offsets, [], no_cuts
+
+        # Breaks as token indices: first token starting at/after each break
+        def token_starts(pattern, position):
+            chars = np.fromiter((position(m) for m in pattern.finditer(text)), dtype=np.int64)
+            return np.searchsorted(offsets[:, 0], chars)
+
+        paragraphs = np.unique(np.concatenate((
+            [0], token_starts(_PARAGRAPH_BREAK, lambda m: m.start()), [n_tokens]
+        )))
+        starts = np.unique(np.concatenate((
+            paragraphs, token_starts(_SENTENCE_BREAK, lambda m: m.end())
+        )))
+
+        # Cut over-long sentences at the budget
+        cuts = no_cuts
+        lengths = np.diff(starts)
+        too_long = np.nonzero(lengths > self.max_tokens)[0]
+        if too_long.size:
+            cuts = np.concatenate([
+                np.arange(starts[i] + self.max_tokens, starts[i + 1], self.max_tokens) for i in too_long
+            ])
+            starts = np.union1d(starts, cuts)
+
+        # Greedy packing within each paragraph; every sentence fits, so each step advances
+        spans = []
+        for first, stop in zip(paragraphs[:-1], paragraphs[1:]):
+            bounds = starts[(starts >= first) & (starts <= stop)]
+            last = len(bounds) - 1
+            i = 0
+            while i < last:
+                start = bounds[i]
+                j = int(np.searchsorted(bounds, start + self.max_tokens, side="right")) - 1
+                spans.append((int(start), int(bounds[j])))
+                if j == last:
+                    break
+                # Next chunk re-reads whole sentences covering up to overlap_tokens
+                k = int(np.searchsorted(bounds, bounds[j] - self.overlap_tokens, side="left"))
+                i = k if i < k < j else j
+        return offsets, spans, cuts
+
+    def _emit(self, text: str, final: bool) -> Tuple[List[str], int]:
+        """
+        Chunks of `text`, and the char offset where unconsumed text starts.
+        Unless `final`, the last chunk is held back (it may continue in the
+        next block) and its text is returned for carrying over.
+        """
+        offsets, spans, cuts = self._plan(text)
+        if not final:
+            if len(spans) <= 1:
+                return [], 0
+            carry_token = spans[-1][0]
+            carry_from = int(offsets[carry_token, 0])
+            spans = spans[:-1]
+            # Cuts inside the carried text are counted when it is planned
+            # again; one at its start becomes an ordinary start there
+            self.hard_splits += int(np.count_nonzero(cuts <= carry_token))
+        else:
+            carry_from = len(text)
+            self.hard_splits += int(cuts.size)
+
+        chunks = []
+        for start, end in spans:
+            chunk = text[offsets[start, 0]:offsets[end - 1, 1]].strip()
+            if not chunk:
+                continue
+            n_tokens = end - start
+            if n_tokens < self.min_tokens:
+                self.dropped += 1
+                continue
+            self._token_counts.append(n_tokens)
+            chunks.append(chunk)
+        return chunks, carry_from
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Chunk a whole document."""
+        return self._emit(text, final=True)[0]
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[str]:
+        """
+        Chunk a stream of text blocks (pages, decoded file pieces) in
+        windows of several chunks, so memory stays bounded.
+        """
+        window_chars = WINDOW_CHUNKS * self.max_tokens * CHARS_PER_TOKEN
+        buffer = ""
+        for block in blocks:
+            buffer += block
+            if len(buffer) < window_chars:
+                continue
+            chunks, carry_from = self._emit(buffer, final=False)
+            yield from chunks
+            buffer = buffer[carry_from:]
+        if buffer.strip():
+            yield from self._emit(buffer, final=True)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        counts = np.asarray(self._token_counts, dtype=np.int64)
+        histogram, _ = np.histogram(counts, bins=HISTOGRAM_BINS)
+        labels = [
+            f"{low}-{high - 1}" if high < HISTOGRAM_BINS[-1] else f"{low}+"
+            for low, high in zip(HISTOGRAM_BINS[:-1], HISTOGRAM_BINS[1:])
+        ]
+        return {
+            "chunks": int(counts.size),
+            "max_tokens": self.max_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "mean_tokens": round(float(counts.mean()), 1) if counts.size else 0.0,
+            "token_histogram": dict(zip(labels, histogram.tolist())),
+            # Chunks the encoder would still cut at max_seq_length (special tokens included)
+            "truncated": int(np.count_nonzero(counts + 2 > self.model_max_tokens)),
+            "hard_splits": self.hard_splits,
+            "dropped_tiny": self.dropped,
+        }
@@ -0,0 +1,165 @@
+"""
+Audio encoding and response negotiation for the TTS endpoints
+Output can be PCM WAV or a compressed codec (FLAC, MP3, Opus); clients
+that ask for audio get raw bytes, base64-in-JSON stays the default for
+legacy clients
+"""
+
+import io
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# format -> (libsndfile container, subtype, media type)
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+    "opus": ("OGG", "OPUS", "audio/ogg; codecs=opus"),
+}
+
+DEFAULT_BITRATE_KBPS = {"mp3": 64, "opus": 32}
+
+# libsndfile maps compression_level 0..1 linearly onto these bitrate
+# ranges (kbps per channel); MP3 at <=24 kHz is MPEG-2 and tops out at 160
+_BITRATE_RANGES_KBPS = {
+    "mp3": (8, 160),
+    "opus": (6, 256),
+}
+
+WAV_HEADER_BYTES = 44
+
+
+class AudioFormatError(ValueError):
+    """Unknown format or a codec the local libsndfile cannot write"""
+
+
+@dataclass
+class SynthesisResult:
+    """Encoded audio plus what the response needs to describe it"""
+    audio_bytes: bytes
+    sample_rate: int
+    media_type: str
+    message: str
+    duration_seconds: float = 0.0
+    format: str = "wav"
+    bitrate_kbps: Optional[int] = None
+    uncompressed_bytes: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(0, self.uncompressed_bytes - len(self.audio_bytes))
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-Sample-Rate": str(self.sample_rate),
+            "X-Audio-Duration": f"{self.duration_seconds:.3f}",
+            "X-Audio-Format": self.format,
+            "X-Audio-Bytes": str(len(self.audio_bytes)),
+            "X-Audio-Bytes-Saved": str(self.bytes_saved),
+            "X-TTS-Message": self.message.encode("ascii", "ignore").decode("ascii"),
+        }
+        if self.bitrate_kbps:
+            headers["X-Audio-Bitrate"] = f"{self.bitrate_kbps}k"
+        return headers
+
+
+def encode_wav(wav, sample_rate: int) -> bytes:
+    """Encode a waveform tensor as PCM WAV bytes"""
+    import torchaudio as ta
+
+    audio_buffer = io.BytesIO()
+    ta.save(audio_buffer, wav, sample_rate, format="wav")
+    return audio_buffer.getvalue()
+
+
+def normalize_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or "wav").lower()
+    if fmt == "ogg":
+        fmt = "opus"
+    if fmt not in AUDIO_FORMATS:
+        raise AudioFormatError(f"Unsupported format '{fmt}' (choose from {', '.join(AUDIO_FORMATS)})")
+    return fmt
+
+
+def resolve_bitrate(fmt: str, bitrate_kbps: Optional[int]) -> Optional[int]:
+    """Bitrate actually used for a format: default if unset, clamped to the codec range"""
+    if fmt not in _BITRATE_RANGES_KBPS:
+        return None
+    low, high = _BITRATE_RANGES_KBPS[fmt]
+    return min(max(bitrate_kbps or DEFAULT_BITRATE_KBPS[fmt], low), high)
+
+
+def _compression_level(fmt: str, bitrate_kbps: int) -> float:
+    low, high = _BITRATE_RANGES_KBPS[fmt]
+    return 1.0 - (bitrate_kbps - low) / float(high - low)
+
+
+def encode_audio(wav, sample_rate: int, fmt: str = "wav",
+                 bitrate_kbps: Optional[int] = None) -> Tuple[bytes, str, Optional[int]]:
+    """
+    Encode a waveform tensor; returns (bytes, media type, bitrate used)
+    Safe to call from worker threads - libsndfile runs without the GIL
+    """
+    fmt = normalize_format(fmt)
+    if fmt == "wav":
+        return encode_wav(wav, sample_rate), AUDIO_FORMATS["wav"][2], None
+
+    import soundfile as sf
+
+    container, subtype, media_type = AUDIO_FORMATS[fmt]
+    if subtype not in sf.available_subtypes(container):
+        raise AudioFormatError(f"Format '{fmt}' is not supported by the installed libsndfile")
+
+    samples = wav.detach().reshape(-1).float().cpu().numpy()
+    write_args = {}
+    bitrate_kbps = resolve_bitrate(fmt, bitrate_kbps)
+    if bitrate_kbps is not None:
+        write_args = {
+            "compression_level": _compression_level(fmt, bitrate_kbps),
+            "bitrate_mode": "CONSTANT",
+        }
+
+    audio_buffer = io.BytesIO()
+    sf.write(audio_buffer, samples, sample_rate, format=container, subtype=subtype, **write_args)
+    return audio_buffer.getvalue(), media_type, bitrate_kbps
+
+
+def uncompressed_size(wav) -> int:
+    """Approximate size of the same audio as the default format=wav output"""
+    return WAV_HEADER_BYTES + wav.numel() * wav.element_size()
+
+
+def _parse_accept(accept: str) -> Dict[str, float]:
+    """Map media ranges in an Accept header to their q values"""
+    ranges = {}
+    for part in accept.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        media_range = fields[0].lower()
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        ranges[media_range] = max(quality, ranges.get(media_range, 0.0))
+    return ranges
+
+
+def wants_binary(accept: Optional[str], response_format: Optional[str] = None) -> bool:
+    """
+    Decide between raw audio and base64 JSON
+    An explicit response_format wins; otherwise raw audio is sent only when
+    the Accept header prefers an audio type over JSON (``*/*`` stays JSON)
+    """
+    if response_format:
+        return response_format.lower() in ("binary", "audio", "raw")
+    if not accept:
+        return False
+
+    ranges = _parse_accept(accept)
+    audio_q = max((q for media, q in ranges.items() if media.startswith("audio/")), default=0.0)
+    json_q = max(ranges.get("application/json", 0.0), ranges.get("application/*", 0.0))
+    return audio_q > 0 and audio_q > json_q
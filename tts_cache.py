@@ -0,0 +1,197 @@
+"""
+Content-addressed cache of synthesized audio
+Seeded ChatterboxTTS generation is deterministic for the same text, voice
+and sampling params, so the encoded result can be replayed without the model.
+Two tiers: an in-memory LRU and an on-disk store, each with a byte budget,
+plus a TTL on every entry.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def audio_cache_key(namespace: str, text: str, voice_key: Optional[str], exaggeration: float,
+                    temperature: float, cfg_weight: float, seed: int, fmt: str,
+                    bitrate_kbps: Optional[int]) -> str:
+    """Hash every input that affects the encoded output"""
+    payload = json.dumps(
+        [namespace, text, voice_key or "default", round(exaggeration, 4), round(temperature, 4),
+         round(cfg_weight, 4), seed, fmt, bitrate_kbps],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Two-tier (memory + disk) LRU of encoded audio with size budgets and TTL"""
+
+    def __init__(self, directory: Optional[str], max_memory_bytes: int = 64 * 1024 * 1024,
+                 max_disk_bytes: int = 512 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.directory = directory if directory and max_disk_bytes > 0 else None
+        self.max_memory_bytes = max(0, max_memory_bytes)
+        self.max_disk_bytes = max(0, max_disk_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        # key -> (audio bytes, metadata); metadata carries created_at
+        self._memory: "OrderedDict[str, Tuple[bytes, Dict[str, Any]]]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> (size on disk, last access)
+        self._disk_index: Dict[str, Tuple[int, float]] = {}
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    # ---- disk helpers -------------------------------------------------
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".bin", base + ".json"
+
+    def _load_disk_index(self):
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if not filename.endswith(".bin"):
+                    continue
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                self._disk_index[filename[:-4]] = (stat.st_size, stat.st_mtime)
+                self._disk_bytes += stat.st_size
+
+    def _remove_disk(self, key: str):
+        size, _ = self._disk_index.pop(key, (0, 0))
+        self._disk_bytes -= size
+        for path in self._paths(key):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _read_disk(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        audio_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(audio_path, "rb") as f:
+                audio = f.read()
+        except (OSError, ValueError):
+            self._remove_disk(key)
+            return None
+        now = time.time()
+        os.utime(audio_path, (now, now))
+        self._disk_index[key] = (len(audio), now)
+        return audio, meta
+
+    def _write_disk(self, key: str, audio: bytes, meta: Dict[str, Any]):
+        if len(audio) > self.max_disk_bytes:
+            return
+        audio_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+        tmp_path = audio_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, audio_path)
+
+        if key in self._disk_index:
+            self._disk_bytes -= self._disk_index[key][0]
+        self._disk_index[key] = (len(audio), time.time())
+        self._disk_bytes += len(audio)
+
+        while self._disk_bytes > self.max_disk_bytes and self._disk_index:
+            oldest = min(self._disk_index, key=lambda k: self._disk_index[k][1])
+            self._remove_disk(oldest)
+            self.evictions += 1
+
+    # ---- memory helpers -----------------------------------------------
+
+    def _put_memory(self, key: str, audio: bytes, meta: Dict[str, Any]):
+        if len(audio) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[0])
+        self._memory[key] = (audio, meta)
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _is_expired(self, meta: Dict[str, Any]) -> bool:
+        return self.ttl_seconds > 0 and time.time() - meta.get("created_at", 0) > self.ttl_seconds
+
+    # ---- public API ---------------------------------------------------
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_expired(entry[1]):
+                    self._memory_bytes -= len(self._memory.pop(key)[0])
+                    if key in self._disk_index:
+                        self._remove_disk(key)
+                    self.expired += 1
+                    return None
+                else:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry
+
+            if self.directory and key in self._disk_index:
+                entry = self._read_disk(key)
+                if entry is not None:
+                    if self._is_expired(entry[1]):
+                        self._remove_disk(key)
+                        self.expired += 1
+                        return None
+                    else:
+                        self._put_memory(key, *entry)
+                        self.disk_hits += 1
+                        return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, audio: bytes, meta: Dict[str, Any]):
+        meta = dict(meta, created_at=time.time())
+        with self._lock:
+            self._put_memory(key, audio, meta)
+            if self.directory:
+                try:
+                    self._write_disk(key, audio, meta)
+                except OSError as e:
+                    print(f"⚠️  Warning: Could not write audio cache entry: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses + self.expired
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes if self.directory else 0,
+                "ttl_seconds": self.ttl_seconds,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,231 @@
+"""
+Micro-batching scheduler for TTS requests
+Requests wait in a bounded queue for a short batching window, compatible
+ones are grouped, and each group is handed to a batch runner on a
+dedicated executor so the event loop stays free for health/status traffic
+"""
+
+import asyncio
+import math
+import time
+from concurrent.futures import Executor
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+
+@dataclass
+class SynthesisJob:
+    """One queued TTS request"""
+    text: str
+    exaggeration: float
+    temperature: float
+    cfg_weight: float
+    seed: int
+    voice_key: Optional[str] = None
+    audio_bytes: Optional[bytes] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    future: Optional[asyncio.Future] = None
+
+    def batch_key(self) -> Hashable:
+        """Requests sharing a voice and sampling params can share a forward pass"""
+        return (self.voice_key, self.exaggeration, self.temperature, self.cfg_weight)
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue is full; carries a Retry-After hint"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"TTS queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class MicroBatchScheduler:
+    """
+    Collects jobs for up to ``max_wait_ms`` (or until ``max_batch_size`` jobs
+    are waiting), groups them by ``batch_key`` and runs each group through
+    ``run_batch(jobs) -> results`` on ``executor``. A result that is an
+    Exception fails only its own job.
+
+    At most ``max_concurrency`` groups run at once and at most ``max_queue``
+    jobs may be admitted (queued or running); beyond that ``submit`` raises
+    ``QueueFullError`` immediately instead of letting latency grow unbounded.
+    """
+
+    def __init__(self,
+                 run_batch: Callable[[List[SynthesisJob]], List[Any]],
+                 max_batch_size: int = 4,
+                 max_wait_ms: float = 10.0,
+                 executor: Optional[Executor] = None,
+                 max_concurrency: int = 1,
+                 max_queue: int = 32,
+                 metrics_window: int = 1000):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: set = set()
+        self._admitted = 0
+
+        self.rejected = 0
+        self.batches_run = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.batch_sizes: Counter = Counter()
+        self._queue_waits: Deque[float] = deque(maxlen=metrics_window)
+        self._batch_times: Deque[float] = deque(maxlen=metrics_window)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current backlog drains"""
+        batch_times = list(self._batch_times)
+        per_batch = _percentile(batch_times, 50) if batch_times else 5.0
+        batches_ahead = math.ceil(self._admitted / self.max_batch_size / self.max_concurrency)
+        return int(min(60, max(1, math.ceil(batches_ahead * per_batch))))
+
+    def is_full(self) -> bool:
+        return self._admitted >= self.max_queue
+
+    async def submit(self, job: SynthesisJob) -> Any:
+        """Queue a job and wait for its result; fails fast when the queue is full"""
+        if self.is_full():
+            self.rejected += 1
+            raise QueueFullError(self.retry_after())
+
+        self._ensure_worker()
+        job.future = asyncio.get_running_loop().create_future()
+        job.enqueued_at = time.perf_counter()
+        self._admitted += 1
+        try:
+            self._queue.put_nowait(job)
+            return await job.future
+        finally:
+            self._admitted -= 1
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _collect(self) -> List[SynthesisJob]:
+        jobs = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(jobs) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return jobs
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first so the next batch keeps filling
+            # while the previous one is still running
+            await self._slots.acquire()
+            try:
+                jobs = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            groups: Dict[Hashable, List[SynthesisJob]] = {}
+            for job in jobs:
+                groups.setdefault(job.batch_key(), []).append(job)
+
+            for index, group in enumerate(groups.values()):
+                if index > 0:
+                    await self._slots.acquire()
+                task = asyncio.get_running_loop().create_task(self._run_group(group))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run_group(self, group: List[SynthesisJob]):
+        try:
+            await self._run_group_in_slot(group)
+        finally:
+            self._slots.release()
+
+    async def _run_group_in_slot(self, group: List[SynthesisJob]):
+        # Callers that went away while queued don't need a forward pass
+        group = [job for job in group if not job.future.done()]
+        if not group:
+            return
+
+        started = time.perf_counter()
+        for job in group:
+            self._queue_waits.append(started - job.enqueued_at)
+
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, self.run_batch, group)
+        except Exception as e:
+            results = [e] * len(group)
+
+        self.batches_run += 1
+        self.batch_sizes[len(group)] += 1
+        self._batch_times.append(time.perf_counter() - started)
+
+        for job, result in zip(group, results):
+            if job.future.done():
+                continue
+            if isinstance(result, Exception):
+                self.jobs_failed += 1
+                job.future.set_exception(result)
+            else:
+                self.jobs_completed += 1
+                job.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self._queue_waits)
+        batch_times = list(self._batch_times)
+        total_jobs = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "admitted": self._admitted,
+            "running_batches": len(self._running),
+            "rejected": self.rejected,
+            "batches_run": self.batches_run,
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "mean_batch_size": round(total_jobs / self.batches_run, 2) if self.batches_run else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "queue_wait_ms": {
+                "p50": round(_percentile(waits, 50) * 1000, 2),
+                "p99": round(_percentile(waits, 99) * 1000, 2),
+            },
+            "batch_time_ms": {
+                "p50": round(_percentile(batch_times, 50) * 1000, 2),
+                "p99": round(_percentile(batch_times, 99) * 1000, 2),
+            },
+        }
@@ -0,0 +1,83 @@
+"""
+Helpers for streaming TTS output
+Text is split at sentence boundaries so each segment can be synthesized and
+sent while the next one is still generating
+"""
+
+import re
+import struct
+from typing import List
+
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?…。！？])|(?<=[.!?…。！？]["\')\]]))\s+|\n{2,}')
+_CLAUSE_END = re.compile(r'(?<=[,;:—])\s+')
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Break an over-long sentence at clause boundaries, then at whitespace"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    current = ""
+    for clause in _CLAUSE_END.split(sentence):
+        candidate = f"{current} {clause}".strip()
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        # A single clause that is still too long gets cut between words
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        current = clause
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sentences(text: str, max_chars: int = 300, min_chars: int = 20) -> List[str]:
+    """
+    Split text into synthesis segments of at most ``max_chars``
+    Short sentences are merged with their neighbour, except the first one,
+    which is kept short so the first audio arrives as early as possible
+    """
+    segments: List[str] = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        for piece in _split_long(sentence, max_chars):
+            if (len(segments) > 1 and len(segments[-1]) < min_chars
+                    and len(segments[-1]) + len(piece) + 1 <= max_chars):
+                segments[-1] = f"{segments[-1]} {piece}"
+            else:
+                segments.append(piece)
+    return segments
+
+
+def wav_stream_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    RIFF/WAVE header for a PCM stream of unknown length
+    The size fields are set to the maximum value, which players treat as
+    "read until the connection closes"
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    unknown_size = 0xFFFFFFFF
+    return (
+        b"RIFF" + struct.pack("<I", unknown_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate,
+                                byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", unknown_size)
+    )
+
+
+def to_pcm16(wav) -> bytes:
+    """Convert a float waveform tensor in [-1, 1] to little-endian 16-bit PCM"""
+    import torch
+
+    samples = wav.detach().reshape(-1).clamp(-1.0, 1.0)
+    return (samples * 32767.0).round().to(torch.int16).cpu().numpy().tobytes()
@@ -0,0 +1,238 @@
+"""
+Tune the HNSW parameters of the chroma collection.
+
+Sweeps M x construction_ef x search_ef with hnswlib (the index library
+Chroma embeds), on a held-out query set: one graph is built per
+(M, construction_ef) and searched at every search_ef. Reported per
+setting: recall@k against exact search, p50/p99 single-query latency,
+build time and index size. The fastest setting that reaches
+--target-recall is then rebuilt as a real Chroma collection to confirm
+it end to end, and written to the env file as HNSW_* variables.
+
+Usage:
+    python tune_hnsw.py --from-collection --target-recall 0.95
+    python tune_hnsw.py --n 50000 --m 8 16 32 --search-ef 16 32 64 128 --no-write
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from kb_config import KBConfig
+from benchmark_vector_backends import synthetic_corpus
+from vector_store import ChromaVectorStore, hnsw_metadata, open_vector_store
+
+ADD_BATCH = 1000
+
+
+def held_out_split(corpus: np.ndarray, n_queries: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Remove n_queries vectors from the corpus to use as queries"""
+    rng = np.random.default_rng(seed)
+    n_queries = min(n_queries, len(corpus) // 10 or 1)
+    picked = np.zeros(len(corpus), dtype=bool)
+    picked[rng.choice(len(corpus), n_queries, replace=False)] = True
+    return corpus[~picked], corpus[picked]
+
+
+def load_corpus(args) -> Tuple[np.ndarray, np.ndarray]:
+    if args.from_collection:
+        store = open_vector_store()
+        corpus = np.asarray(store.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+        if len(corpus) < 2:
+            raise SystemExit(f"The {KBConfig.VECTOR_BACKEND} collection has too few vectors to tune on")
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        corpus, queries = held_out_split(corpus, args.queries)
+    else:
+        corpus, queries = synthetic_corpus(args.n, args.dim, args.queries)
+
+    if args.query_file:
+        from stella_embeddings import StellaEmbeddingService
+        with open(args.query_file) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        queries = np.stack(StellaEmbeddingService().encode_queries(lines))
+    return corpus.astype(np.float32), queries.astype(np.float32)
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    scores = queries @ corpus.T
+    return [set(row.tolist()) for row in np.argpartition(-scores, k - 1, axis=1)[:, :k]]
+
+
+def _recall(truth: List[set], found: List[List[int]], k: int) -> float:
+    hits = sum(len(t & set(f)) for t, f in zip(truth, found))
+    return round(hits / float(k * len(truth)), 4)
+
+
+def _latency_ms(latencies: List[float]) -> Tuple[float, float]:
+    latencies_ms = np.asarray(latencies) * 1000
+    return (round(float(np.percentile(latencies_ms, 50)), 3),
+            round(float(np.percentile(latencies_ms, 99)), 3))
+
+
+def sweep(corpus: np.ndarray, queries: np.ndarray, truth: List[set], k: int,
+          ms: List[int], construction_efs: List[int], search_efs: List[int]) -> List[Dict[str, Any]]:
+    import hnswlib
+
+    results = []
+    for m in ms:
+        for construction_ef in construction_efs:
+            index = hnswlib.Index(space="cosine", dim=corpus.shape[1])
+            start = time.perf_counter()
+            index.init_index(max_elements=len(corpus), M=m, ef_construction=construction_ef)
+            index.add_items(corpus, np.arange(len(corpus)))
+            build_seconds = time.perf_counter() - start
+
+            with tempfile.NamedTemporaryFile(suffix=".bin") as tmp:
+                index.save_index(tmp.name)
+                index_mb = os.path.getsize(tmp.name) / 1e6
+
+            # Queries one at a time on one thread, as the server issues them
+            index.set_num_threads(1)
+            for search_ef in search_efs:
+                index.set_ef(max(search_ef, k))
+                latencies, found = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    labels, _ = index.knn_query(query, k=k)
+                    latencies.append(time.perf_counter() - start)
+                    found.append(labels[0].tolist())
+                p50, p99 = _latency_ms(latencies)
+                results.append({
+                    "m": m,
+                    "construction_ef": construction_ef,
+                    "search_ef": search_ef,
+                    "recall_at_k": _recall(truth, found, k),
+                    "p50_ms": p50,
+                    "p99_ms": p99,
+                    "build_seconds": round(build_seconds, 2),
+                    "index_mb": round(index_mb, 1),
+                })
+                print(json.dumps(results[-1]))
+    return results
+
+
+def choose(results: List[Dict[str, Any]], target_recall: float,
+           max_p99_ms: Optional[float]) -> Tuple[Dict[str, Any], bool]:
+    """Lowest p99 (then smallest index) meeting the targets; else the best recall"""
+    meeting = [
+        r for r in results
+        if r["recall_at_k"] >= target_recall and (max_p99_ms is None or r["p99_ms"] <= max_p99_ms)
+    ]
+    if meeting:
+        return min(meeting, key=lambda r: (r["p99_ms"], r["index_mb"], r["build_seconds"])), True
+    return max(results, key=lambda r: (r["recall_at_k"], -r["p99_ms"])), False
+
+
+def validate_with_chroma(corpus: np.ndarray, queries: np.ndarray, truth: List[set], k: int,
+                         setting: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a Chroma collection with `setting` and measure it through the collection API"""
+    directory = tempfile.mkdtemp(prefix="tune-hnsw-")
+    try:
+        hnsw = hnsw_metadata(setting["m"], setting["construction_ef"], setting["search_ef"])
+        store = ChromaVectorStore(directory, "tune_hnsw", hnsw=hnsw)
+        ids = [str(i) for i in range(len(corpus))]
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), ADD_BATCH):
+            store.add(ids=ids[offset:offset + ADD_BATCH], embeddings=corpus[offset:offset + ADD_BATCH])
+        build_seconds = time.perf_counter() - start
+
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            ids_found = store.query(query_embeddings=query[None, :], n_results=k, include=[])["ids"][0]
+            latencies.append(time.perf_counter() - start)
+            found.append([int(doc_id) for doc_id in ids_found])
+        p50, p99 = _latency_ms(latencies)
+        disk_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(directory) for name in files
+        )
+        return {
+            "recall_at_k": _recall(truth, found, k),
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "build_seconds": round(build_seconds, 2),
+            "disk_mb": round(disk_bytes / 1e6, 1),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_env(path: str, settings: Dict[str, Any]):
+    """Set `settings` in a dotenv file, keeping every other line"""
+    lines = []
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = f.read().splitlines()
+    remaining = dict(settings)
+    for i, line in enumerate(lines):
+        key = line.split("=", 1)[0].strip()
+        if key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+    lines.extend(f"{key}={value}" for key, value in remaining.items())
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep HNSW parameters and pick settings for the chroma collection")
+    parser.add_argument("--from-collection", action="store_true",
+                        help="Tune on the stored embeddings, holding out --queries of them")
+    parser.add_argument("--n", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=KBConfig.EMBEDDING_DIMENSION)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-file", help="Text file with one query per line (encoded with Stella)")
+    parser.add_argument("--k", type=int, default=KBConfig.TOP_K_RESULTS)
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--env-file", default=".env")
+    parser.add_argument("--no-write", action="store_true", help="Report only; leave the env file alone")
+    parser.add_argument("--skip-chroma", action="store_true", help="Skip the end-to-end Chroma check")
+    args = parser.parse_args()
+
+    corpus, queries = load_corpus(args)
+    k = min(args.k, len(corpus))
+    truth = exact_neighbours(corpus, queries, k)
+    print(f"Corpus: {len(corpus)} x {corpus.shape[1]}, {len(queries)} held-out queries, k={k}")
+
+    results = sweep(corpus, queries, truth, k, args.m, args.construction_ef, args.search_ef)
+    best, met = choose(results, args.target_recall, args.max_p99_ms)
+
+    print(f"\n{'M':>4} {'c_ef':>5} {'s_ef':>5} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} {'MB':>7}")
+    for r in results:
+        marker = " <" if r is best else ""
+        print(f"{r['m']:>4} {r['construction_ef']:>5} {r['search_ef']:>5} {r['recall_at_k']:>7} "
+              f"{r['p50_ms']:>8} {r['p99_ms']:>8} {r['build_seconds']:>8} {r['index_mb']:>7}{marker}")
+    if not met:
+        print(f"\nNo setting reached recall {args.target_recall}"
+              + (f" within p99 {args.max_p99_ms} ms" if args.max_p99_ms else "") + "; using the best recall")
+
+    if not args.skip_chroma:
+        print("\nChroma check:", json.dumps(validate_with_chroma(corpus, queries, truth, k, best)))
+
+    settings = {
+        "HNSW_M": best["m"],
+        "HNSW_CONSTRUCTION_EF": best["construction_ef"],
+        "HNSW_SEARCH_EF": best["search_ef"],
+    }
+    if args.no_write:
+        print(f"\nChosen: {settings}")
+        return
+    write_env(args.env_file, settings)
+    print(f"\nWrote {settings} to {args.env_file}")
+    if (settings["HNSW_M"], settings["HNSW_CONSTRUCTION_EF"], settings["HNSW_SEARCH_EF"]) != \
+            (KBConfig.HNSW_M, KBConfig.HNSW_CONSTRUCTION_EF, KBConfig.HNSW_SEARCH_EF):
+        print("Existing collections keep the settings they were built with: "
+              "reset the knowledge base and re-ingest to apply these")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,768 @@
+"""
+Vector storage backends for the knowledge base.
+
+Every backend implements the subset of the ChromaDB collection API that
+LocalVectorDB uses (add/upsert/get/update/delete/query/count) plus
+reset/stats, and is chosen with KBConfig.VECTOR_BACKEND:
+
+- chroma: ChromaDB persistent collection (HNSW)
+- flat: memory-mapped float32 matrix searched by brute force; exact and
+  fastest for small-to-medium corpora
+- int8 / binary: QuantizedVectorStore - quantized codes for candidate
+  generation plus a memory-mapped float16 copy of every vector for exact
+  rescoring of the top candidates
+
+The local stores append vectors to contiguous files (an append-only log)
+and read them through memory maps in blocks.
+
+Usage (recall of a quantized store against exact scoring of its float16
+vectors; benchmark_vector_backends.py compares against float32):
+    python vector_store.py --k 10 --sample 200
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from kb_config import KBConfig
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per step when scanning binary codes
+SCAN_BLOCK_ROWS = 65536
+# Blocks that are upcast to float32 (int8 codes, float16 vectors) are sized
+# to about this many bytes, so a scan needs tens of MB of scratch, not hundreds
+FLOAT_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def _float_block_rows(dimension: int) -> int:
+    return max(256, FLOAT_BLOCK_BYTES // (4 * dimension))
+
+# The int8 scale is recomputed (and stored codes re-encoded) on every add
+# until the store holds this many rows
+CALIBRATION_ROWS = 4096
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[values]
+
+
+def _where_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Translate a Chroma-style metadata filter into SQL over the metadata JSON."""
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+
+        field = "json_extract(metadata, ?)"
+        path = f'$."{key}"'
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(value))
+                negate = "NOT " if op == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path, *value])
+            else:
+                sql_op = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}.get(op)
+                if sql_op is None:
+                    raise ValueError(f"Unsupported where operator: {op}")
+                clauses.append(f"{field} {sql_op} ?")
+                params.extend([path, value])
+    return " AND ".join(clauses) or "1", params
+
+
+class BaseVectorStore:
+    """
+    Row bookkeeping shared by the on-disk stores: vectors live in
+    append-only files indexed by row number, while ids, documents and
+    metadata live in sqlite. Deleting drops the sqlite row; the vector
+    slot stays in the file but is masked out of searches.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        self.directory = directory
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # ---- subclass hooks -----------------------------------------------
+
+    def _files(self) -> Dict[str, Tuple[np.dtype, int]]:
+        """file name -> (dtype, values per row) of every per-row vector file"""
+        raise NotImplementedError
+
+    def _encode_rows(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        """Per-file arrays to append for these (normalized float32) vectors"""
+        raise NotImplementedError
+
+    def _search(self, queries: np.ndarray, n_results: int, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, similarities), each (queries, n_results), best first; rows -1 for empty slots"""
+        raise NotImplementedError
+
+    # ---- storage ------------------------------------------------------
+
+    def _open(self):
+        self._db = sqlite3.connect(os.path.join(self.directory, "rows.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self._db.commit()
+
+        # Rows fully written to every file; a crash mid-append leaves a partial tail
+        sizes = [
+            os.path.getsize(self._path(name)) // (np.dtype(dtype).itemsize * width)
+            if os.path.exists(self._path(name)) else 0
+            for name, (dtype, width) in self._files().items()
+        ]
+        self._rows = min(sizes) if sizes else 0
+        for name, (dtype, width) in self._files().items():
+            if os.path.exists(self._path(name)):
+                with open(self._path(name), "r+b") as f:
+                    f.truncate(self._rows * np.dtype(dtype).itemsize * width)
+        self._db.execute("DELETE FROM rows WHERE row >= ?", (self._rows,))
+        self._db.commit()
+
+        self._alive = np.zeros(self._rows, dtype=bool)
+        live_rows = [row for (row,) in self._db.execute("SELECT row FROM rows")]
+        self._alive[live_rows] = True
+        self._maps: Dict[str, np.ndarray] = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _map(self, name: str) -> np.ndarray:
+        """Read-only memory map of a vector file (cached until the next append)"""
+        if name not in self._maps:
+            dtype, width = self._files()[name]
+            if self._rows == 0:
+                return np.empty((0, width), dtype=dtype)
+            self._maps[name] = np.memmap(self._path(name), dtype=dtype, mode="r", shape=(self._rows, width))
+        return self._maps[name]
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _append(self, vectors: np.ndarray) -> np.ndarray:
+        """Append vectors to every file; returns their row numbers"""
+        encoded = self._encode_rows(vectors)
+        for name, array in encoded.items():
+            with open(self._path(name), "ab") as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+        rows = np.arange(self._rows, self._rows + len(vectors))
+        self._rows += len(vectors)
+        self._alive = np.concatenate((self._alive, np.ones(len(vectors), dtype=bool)))
+        self._maps.clear()
+        return rows
+
+    def _rows_for(self, ids: Sequence[str]) -> Dict[str, int]:
+        found = {}
+        for start in range(0, len(ids), 500):
+            chunk = list(ids[start:start + 500])
+            found.update(self._db.execute(
+                f"SELECT id, row FROM rows WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return found
+
+    def _allowed_rows(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not where:
+            return self._alive
+        sql, params = _where_sql(where)
+        allowed = np.zeros(self._rows, dtype=bool)
+        rows = [row for (row,) in self._db.execute(f"SELECT row FROM rows WHERE {sql}", params)]
+        allowed[rows] = True
+        return allowed
+
+    # ---- collection API -----------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._alive.sum())
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict]] = None):
+        """Add new entries; ids that already exist are left untouched (as in Chroma)"""
+        with self._lock:
+            existing = self._rows_for(ids)
+            positions = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            # Keep the first of any ids repeated within the call
+            seen = set()
+            positions = [i for i in positions if not (ids[i] in seen or seen.add(ids[i]))]
+            if not positions:
+                return
+            vectors = self._normalize(embeddings)[positions]
+            rows = self._append(vectors)
+            self._db.executemany(
+                "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (int(row), ids[i], documents[i] if documents else None,
+                     json.dumps(metadatas[i]) if metadatas else None)
+                    for row, i in zip(rows, positions)
+                ],
+            )
+            self._db.commit()
+
+    def upsert(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict]] = None):
+        with self._lock:
+            self.delete(ids=ids)
+            self.add(ids, embeddings, documents, metadatas)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, include: Sequence[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        with self._lock:
+            sql, params = _where_sql(where) if where else ("1", [])
+            if ids is not None:
+                found = self._rows_for(ids)
+                rows = [found[doc_id] for doc_id in ids if doc_id in found]
+                if where:
+                    allowed = self._allowed_rows(where)
+                    rows = [row for row in rows if allowed[row]]
+                records = self._records(rows)
+            else:
+                query = f"SELECT row FROM rows WHERE {sql} ORDER BY row"
+                if limit:
+                    query += f" LIMIT {int(limit)}"
+                records = self._records([row for (row,) in self._db.execute(query, params)])
+
+            result: Dict[str, Any] = {"ids": [record[0] for record in records]}
+            if "documents" in include:
+                result["documents"] = [record[1] for record in records]
+            if "metadatas" in include:
+                result["metadatas"] = [json.loads(record[2]) if record[2] else None for record in records]
+            if "embeddings" in include:
+                result["embeddings"] = [self._full_vector(record[3]).tolist() for record in records]
+            return result
+
+    def _records(self, rows: List[int]) -> List[Tuple[str, Optional[str], Optional[str], int]]:
+        """(id, document, metadata json, row) for rows, in the given order"""
+        by_row = {}
+        for start in range(0, len(rows), 500):
+            chunk = rows[start:start + 500]
+            for doc_id, document, metadata, row in self._db.execute(
+                f"SELECT id, document, metadata, row FROM rows WHERE row IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                by_row[row] = (doc_id, document, metadata, row)
+        return [by_row[row] for row in rows if row in by_row]
+
+    def _full_vector(self, row: int) -> np.ndarray:
+        return np.asarray(self._full_matrix()[row], dtype=np.float32)
+
+    def _full_matrix(self) -> np.ndarray:
+        """(rows, dimension) full-precision vectors, possibly memory-mapped"""
+        raise NotImplementedError
+
+    def update(self, ids: List[str], embeddings=None, documents: Optional[List[str]] = None,
+               metadatas: Optional[List[Dict]] = None):
+        with self._lock:
+            if embeddings is not None:
+                current = self.get(ids=ids)
+                lookup = dict(zip(current["ids"], zip(current["documents"], current["metadatas"])))
+                self.upsert(
+                    ids, embeddings,
+                    documents or [lookup.get(doc_id, (None, None))[0] for doc_id in ids],
+                    metadatas or [lookup.get(doc_id, (None, None))[1] for doc_id in ids],
+                )
+                return
+            for i, doc_id in enumerate(ids):
+                if metadatas is not None:
+                    self._db.execute("UPDATE rows SET metadata = ? WHERE id = ?", (json.dumps(metadatas[i]), doc_id))
+                if documents is not None:
+                    self._db.execute("UPDATE rows SET document = ? WHERE id = ?", (documents[i], doc_id))
+            self._db.commit()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            if ids is not None:
+                rows = list(self._rows_for(ids).values())
+            elif where:
+                rows = np.nonzero(self._allowed_rows(where) & self._alive)[0].tolist()
+            else:
+                return
+            if not rows:
+                return
+            for start in range(0, len(rows), 500):
+                chunk = rows[start:start + 500]
+                self._db.execute(f"DELETE FROM rows WHERE row IN ({','.join('?' * len(chunk))})", chunk)
+            self._db.commit()
+            self._alive[rows] = False
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = ("documents", "metadatas", "distances")) -> Dict[str, List[List[Any]]]:
+        """Cosine search; distances are 1 - cosine similarity, as for an hnsw:space=cosine collection"""
+        with self._lock:
+            queries = self._normalize(query_embeddings)
+            allowed = self._allowed_rows(where) & self._alive
+            n_results = min(n_results, int(allowed.sum()))
+            result: Dict[str, List[List[Any]]] = {"ids": []}
+            for key in ("documents", "metadatas", "distances"):
+                if key in include:
+                    result[key] = []
+            if n_results == 0:
+                for key in result:
+                    result[key] = [[] for _ in queries]
+                return result
+
+            rows, similarities = self._search(queries, n_results, allowed)
+            for q in range(len(queries)):
+                valid = rows[q] >= 0
+                records = self._records(rows[q][valid].tolist())
+                result["ids"].append([record[0] for record in records])
+                if "documents" in result:
+                    result["documents"].append([record[1] for record in records])
+                if "metadatas" in result:
+                    result["metadatas"].append([json.loads(record[2]) if record[2] else None for record in records])
+                if "distances" in result:
+                    result["distances"].append((1.0 - similarities[q][valid]).tolist())
+            return result
+
+    def reset(self):
+        """Delete every entry and file"""
+        with self._lock:
+            self._db.close()
+            self._maps.clear()
+            shutil.rmtree(self.directory)
+            os.makedirs(self.directory, exist_ok=True)
+            self._open()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            file_bytes = {
+                name: os.path.getsize(self._path(name)) if os.path.exists(self._path(name)) else 0
+                for name in self._files()
+            }
+            return {
+                "backend": type(self).__name__,
+                "entries": int(self._alive.sum()),
+                "rows": self._rows,
+                "deleted_rows": int(self._rows - self._alive.sum()),
+                "file_bytes": file_bytes,
+            }
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k of each query's (scores, rows), unsorted"""
+    if scores.shape[1] <= k:
+        return scores, rows
+    index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, index, axis=1), np.take_along_axis(rows, index, axis=1)
+
+
+class QuantizedVectorStore(BaseVectorStore):
+    """
+    int8: each component scaled per dimension to [-127, 127], with the scale
+    calibrated over the first CALIBRATION_ROWS rows; candidates are ranked
+    by the dequantized dot product.
+    binary: one sign bit per component; candidates are ranked by Hamming
+    distance (32x smaller than float32).
+    The top `rescore_factor * n_results` candidates are rescored exactly
+    against the float16 side file.
+    """
+
+    def __init__(self, directory: str, dimension: int, mode: str = "int8",
+                 rescore_factor: Optional[int] = None):
+        if mode not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization mode '{mode}' (int8 or binary)")
+        self.mode = mode
+        self.rescore_factor = rescore_factor or (8 if mode == "int8" else 32)
+        self._scale: Optional[np.ndarray] = None
+        super().__init__(directory, dimension)
+
+    def _open(self):
+        # Also runs on reset(), which deletes scale.npy
+        super()._open()
+        self._scale = None
+        if self.mode != "int8":
+            return
+        if os.path.exists(self._path("scale.npy")):
+            self._scale = np.load(self._path("scale.npy"))
+        elif self._rows:
+            raise RuntimeError(
+                f"{self.directory} holds {self._rows} int8 codes but no scale.npy; "
+                f"reset the store and re-ingest"
+            )
+
+    def _files(self):
+        if self.mode == "int8":
+            codes = (np.int8, self.dimension)
+        else:
+            codes = (np.uint8, (self.dimension + 7) // 8)
+        return {"codes.bin": codes, "vectors.f16": (np.float16, self.dimension)}
+
+    def _quantize(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self._scale), -127, 127).astype(np.int8)
+
+    def _calibrate(self, vectors: np.ndarray):
+        """
+        Per-dimension scale from the stored vectors plus `vectors`, and
+        stored codes re-encoded with it. Runs until CALIBRATION_ROWS rows
+        exist, so the scale never rests on one small first upload.
+        """
+        stored = self._map("vectors.f16")
+        block_rows = _float_block_rows(self.dimension)
+        peak = np.abs(vectors).max(axis=0)
+        for start in range(0, self._rows, block_rows):
+            block = np.asarray(stored[start:start + block_rows], dtype=np.float32)
+            peak = np.maximum(peak, np.abs(block).max(axis=0))
+        self._scale = np.maximum(peak, 1e-6).astype(np.float32) / 127.0
+
+        if self._rows:
+            tmp_path = self._path("codes.bin.tmp")
+            with open(tmp_path, "wb") as f:
+                for start in range(0, self._rows, block_rows):
+                    block = np.asarray(stored[start:start + block_rows], dtype=np.float32)
+                    f.write(self._quantize(block).tobytes())
+            self._maps.clear()
+            os.replace(tmp_path, self._path("codes.bin"))
+        np.save(self._path("scale.npy"), self._scale)
+
+    def _encode_rows(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        if self.mode == "int8":
+            if self._scale is None or self._rows < CALIBRATION_ROWS:
+                self._calibrate(vectors)
+            # Once calibrated, outliers beyond the scale are clipped; the
+            # float16 rescoring still ranks the candidates exactly
+            codes = self._quantize(vectors)
+        else:
+            codes = np.packbits(vectors > 0, axis=1)
+        return {"codes.bin": codes, "vectors.f16": vectors.astype(np.float16)}
+
+    def _full_matrix(self) -> np.ndarray:
+        return self._map("vectors.f16")
+
+    def candidates(self, queries: np.ndarray, n_candidates: int, allowed: np.ndarray) -> np.ndarray:
+        """Rows of the best `n_candidates` by quantized score, (queries, n) with -1 padding"""
+        codes = self._map("codes.bin")
+        if self.mode == "int8":
+            probe = (queries * self._scale).T.astype(np.float32)
+            block_rows = _float_block_rows(self.dimension)
+        else:
+            probe = np.packbits(queries > 0, axis=1)
+            block_rows = SCAN_BLOCK_ROWS
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+        for start in range(0, self._rows, block_rows):
+            stop = min(start + block_rows, self._rows)
+            block_allowed = allowed[start:stop]
+            if not block_allowed.any():
+                continue
+            block = np.asarray(codes[start:stop])
+            if self.mode == "int8":
+                scores = (block.astype(np.float32) @ probe).T
+            else:
+                # Negative Hamming distance, so higher is better
+                scores = -np.stack([
+                    _popcount(np.bitwise_xor(block, bits)).sum(axis=1, dtype=np.int32) for bits in probe
+                ]).astype(np.float32)
+            scores[:, ~block_allowed] = -np.inf
+            rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+            best_scores, best_rows = _top_k(
+                np.concatenate((best_scores, scores), axis=1),
+                np.concatenate((best_rows, rows), axis=1),
+                n_candidates
+            )
+        best_rows = np.where(np.isfinite(best_scores), best_rows, -1)
+        return best_rows
+
+    def _search(self, queries, n_results, allowed):
+        candidate_rows = self.candidates(queries, n_results * self.rescore_factor, allowed)
+        full = self._full_matrix()
+        out_rows = np.full((len(queries), n_results), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), n_results), -np.inf, dtype=np.float32)
+        for q, rows in enumerate(candidate_rows):
+            rows = np.sort(rows[rows >= 0])  # sorted rows read the memory map sequentially
+            if rows.size == 0:
+                continue
+            exact = np.asarray(full[rows], dtype=np.float32) @ queries[q]
+            order = np.argsort(-exact)[:n_results]
+            out_rows[q, :order.size] = rows[order]
+            out_scores[q, :order.size] = exact[order]
+        return out_rows, out_scores
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"mode": self.mode, "rescore_factor": self.rescore_factor})
+        return stats
+
+
+def _scan_top_k(full: np.ndarray, n_rows: int, queries: np.ndarray, k: int,
+                allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k by dot product over `full` in row blocks; (rows, scores)
+    each (queries, k), best first, rows -1 where fewer than k are allowed
+    """
+    block_rows = _float_block_rows(full.shape[1])
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        block_allowed = allowed[start:stop]
+        if not block_allowed.any():
+            continue
+        scores = (np.asarray(full[start:stop], dtype=np.float32) @ queries.T).T
+        scores[:, ~block_allowed] = -np.inf
+        rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+        best_scores, best_rows = _top_k(
+            np.concatenate((best_scores, scores), axis=1),
+            np.concatenate((best_rows, rows), axis=1),
+            k
+        )
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    return np.where(np.isfinite(best_scores), best_rows, -1), best_scores
+
+
+class FlatVectorStore(BaseVectorStore):
+    """
+    Exact search over a contiguous memory-mapped float32 matrix of
+    normalized vectors: one matrix product per block and argpartition
+    for the top k. No index to build or keep in RAM.
+    """
+
+    def _files(self):
+        return {"vectors.f32": (np.float32, self.dimension)}
+
+    def _encode_rows(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        return {"vectors.f32": vectors}
+
+    def _full_matrix(self) -> np.ndarray:
+        return self._map("vectors.f32")
+
+    def _search(self, queries, n_results, allowed):
+        return _scan_top_k(self._full_matrix(), self._rows, queries, n_results, allowed)
+
+
+def exact_search(store: BaseVectorStore, queries: np.ndarray, k: int,
+                 corpus: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Reference top-k rows by exact cosine. `corpus` is the original float32
+    embeddings in store row order; without it the store's own full-precision
+    file is scanned (float16 for the quantized stores).
+    """
+    queries = store._normalize(queries)
+    full = store._full_matrix() if corpus is None else store._normalize(corpus)
+    return _scan_top_k(full, store._rows, queries, k, store._alive)[0]
+
+
+def hnsw_metadata(m: Optional[int] = None, construction_ef: Optional[int] = None,
+                  search_ef: Optional[int] = None) -> Dict[str, Any]:
+    """Chroma collection metadata for a cosine HNSW index; unset values come from KBConfig"""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": m or KBConfig.HNSW_M,
+        "hnsw:construction_ef": construction_ef or KBConfig.HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": search_ef or KBConfig.HNSW_SEARCH_EF,
+        "hnsw:batch_size": KBConfig.HNSW_BATCH_SIZE,
+        "hnsw:sync_threshold": KBConfig.HNSW_SYNC_THRESHOLD,
+    }
+
+
+class ChromaVectorStore:
+    """ChromaDB collection behind the same interface as the local stores"""
+
+    def __init__(self, persist_directory: str, name: str, hnsw: Optional[Dict[str, Any]] = None):
+        import chromadb
+        from chromadb.config import Settings
+
+        # Create directory if it doesn't exist
+        os.makedirs(persist_directory, exist_ok=True)
+        self.name = name
+        self.hnsw = hnsw or hnsw_metadata()
+        self.client = chromadb.PersistentClient(
+            path=persist_directory,
+            settings=Settings(
+                anonymized_telemetry=False,
+                allow_reset=True
+            )
+        )
+        self._init_collection()
+
+    def _init_collection(self):
+        try:
+            self.collection = self.client.get_collection(name=self.name)
+        except Exception:
+            self.collection = self.client.create_collection(
+                name=self.name,
+                metadata=self.hnsw
+            )
+            return
+
+        stored = self.collection.metadata or {}
+        differing = {
+            key: (stored.get(key), value) for key, value in self.hnsw.items()
+            if key in stored and stored[key] != value
+        }
+        if differing:
+            # The graph parameters belong to the existing index; only reset() applies them
+            logger.warning(
+                f"Collection '{self.name}' was built with different HNSW settings "
+                f"(stored, configured): {differing}; reset the knowledge base to apply them"
+            )
+
+    @staticmethod
+    def _lists(embeddings):
+        return embeddings.tolist() if isinstance(embeddings, np.ndarray) else embeddings
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.add(ids=ids, embeddings=self._lists(embeddings), documents=documents, metadatas=metadatas)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.upsert(ids=ids, embeddings=self._lists(embeddings), documents=documents, metadatas=metadatas)
+
+    def get(self, **kwargs):
+        return self.collection.get(**kwargs)
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        self.collection.update(
+            ids=ids,
+            embeddings=self._lists(embeddings) if embeddings is not None else None,
+            documents=documents,
+            metadatas=metadatas
+        )
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def query(self, query_embeddings, **kwargs):
+        return self.collection.query(query_embeddings=self._lists(query_embeddings), **kwargs)
+
+    def reset(self):
+        self.client.delete_collection(self.name)
+        self._init_collection()
+
+    def stats(self) -> Dict[str, Any]:
+        metadata = self.collection.metadata or {}
+        return {
+            "backend": type(self).__name__,
+            "entries": self.count(),
+            "hnsw": {key[len("hnsw:"):]: value for key, value in metadata.items() if key.startswith("hnsw:")},
+        }
+
+
+VECTOR_BACKENDS = ("chroma", "flat", "int8", "binary")
+
+
+def open_vector_store(backend: Optional[str] = None, name: Optional[str] = None,
+                      chroma_directory: Optional[str] = None, store_directory: Optional[str] = None):
+    """Open (or create) the collection `name` on the given backend; defaults come from KBConfig"""
+    backend = (backend or KBConfig.VECTOR_BACKEND).lower()
+    name = name or KBConfig.COLLECTION_NAME
+    if backend == "chroma":
+        return ChromaVectorStore(chroma_directory or KBConfig.CHROMA_PERSIST_DIRECTORY, name)
+
+    directory = os.path.join(store_directory or KBConfig.VECTOR_STORE_DIRECTORY, name)
+    if backend == "flat":
+        return FlatVectorStore(directory, KBConfig.EMBEDDING_DIMENSION)
+    if backend in ("int8", "binary"):
+        return QuantizedVectorStore(directory, KBConfig.EMBEDDING_DIMENSION, backend,
+                                    KBConfig.VECTOR_RESCORE_FACTOR)
+    raise ValueError(f"Unknown VECTOR_BACKEND '{backend}' (choose from {', '.join(VECTOR_BACKENDS)})")
+
+
+def evaluate_recall(store: QuantizedVectorStore, queries: np.ndarray, k: int = 10,
+                    corpus: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Recall@k of the store's search against exact scoring, plus the recall
+    of the quantized candidate set alone (before rescoring), to help pick
+    the mode and rescore factor.
+
+    The ground truth is float32 cosine over `corpus` (the original
+    embeddings, in store row order) when given. Otherwise it is computed
+    from the float16 side file, the only full-precision copy the store
+    keeps: on unit vectors float16 moves a score by about 1e-4, so it only
+    reorders near-ties at rank k (0.9995 overlap with the float32 top 10 on
+    50k x 1024 synthetic vectors). benchmark_vector_backends.py measures
+    against float32.
+    """
+    queries = store._normalize(queries)
+    k = min(k, store.count())
+    if k == 0 or len(queries) == 0:
+        return {"k": k, "queries": len(queries), "recall_at_k": None}
+
+    start = time.perf_counter()
+    truth = exact_search(store, queries, k, corpus)
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found, _ = store._search(queries, k, store._alive)
+    search_seconds = time.perf_counter() - start
+
+    candidates = store.candidates(queries, k * store.rescore_factor, store._alive)
+
+    def recall(results: np.ndarray) -> float:
+        hits = sum(len(set(t.tolist()) & set(r.tolist())) for t, r in zip(truth, results))
+        return round(hits / float(truth.size), 4)
+
+    return {
+        "k": k,
+        "queries": len(queries),
+        "mode": store.mode,
+        "rescore_factor": store.rescore_factor,
+        "truth": "float16" if corpus is None else "float32",
+        "recall_at_k": recall(found),
+        "candidate_recall_at_k": recall(candidates),
+        "search_ms_per_query": round(search_seconds * 1000 / len(queries), 3),
+        "exact_ms_per_query": round(exact_seconds * 1000 / len(queries), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k of the quantized store against exact search "
+                                                 "over its float16 vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", help="Text file with one query per line (encoded with Stella)")
+    parser.add_argument("--sample", type=int, default=200,
+                        help="Without --queries, use this many stored vectors as queries")
+    parser.add_argument("--rescore-factor", type=int, default=None)
+    args = parser.parse_args()
+
+    directory = os.path.join(KBConfig.VECTOR_STORE_DIRECTORY, KBConfig.COLLECTION_NAME)
+    mode = KBConfig.VECTOR_BACKEND if KBConfig.VECTOR_BACKEND in ("int8", "binary") else "int8"
+    store = QuantizedVectorStore(directory, KBConfig.EMBEDDING_DIMENSION, mode,
+                                 args.rescore_factor or KBConfig.VECTOR_RESCORE_FACTOR)
+
+    if args.queries:
+        from stella_embeddings import StellaEmbeddingService
+        with open(args.queries) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        queries = np.stack(StellaEmbeddingService().encode_queries(lines))
+    else:
+        rows = np.nonzero(store._alive)[0]
+        rows = np.random.default_rng(0).choice(rows, size=min(args.sample, rows.size), replace=False)
+        queries = np.asarray(store._full_matrix()[np.sort(rows)], dtype=np.float32)
+
+    print(json.dumps(evaluate_recall(store, queries, args.k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
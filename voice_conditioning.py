@@ -0,0 +1,171 @@
+"""
+Speaker conditioning cache and voice registry for ChatterboxTTS voice cloning
+Prepared conditionals are keyed by a hash of the reference clip bytes,
+so repeat uploads of the same voice skip decode, resample and embedding
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def fingerprint_audio(audio_bytes: bytes) -> str:
+    """Stable content key for a reference clip"""
+    return hashlib.sha256(audio_bytes).hexdigest()[:32]
+
+
+class ConditioningCache:
+    """Bounded LRU of prepared ChatterboxTTS ``Conditionals`` objects"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max(0, max_entries)
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            conds = self._entries.get(key)
+            if conds is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return conds
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: str, conds: Any) -> None:
+        if self.max_entries == 0 or conds is None:
+            return
+        with self._lock:
+            self._entries[key] = conds
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class VoiceRegistry:
+    """
+    On-disk store of prepared conditionals addressed by ``voice_id``
+    Tensors are kept in float16 to keep profiles small; they are upcast on load
+    """
+
+    _VOICE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def is_valid_id(self, voice_id: str) -> bool:
+        return bool(voice_id) and bool(self._VOICE_ID_PATTERN.match(voice_id))
+
+    def _paths(self, voice_id: str):
+        base = os.path.join(self.directory, voice_id)
+        return base + ".pt", base + ".json"
+
+    def exists(self, voice_id: str) -> bool:
+        return self.is_valid_id(voice_id) and os.path.exists(self._paths(voice_id)[0])
+
+    def save(self, voice_id: str, conds: Any, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Persist conditionals plus a small JSON description"""
+        import torch
+
+        def _compact(value):
+            if torch.is_tensor(value):
+                value = value.detach().cpu()
+                return value.half() if value.is_floating_point() else value
+            return value
+
+        tensor_path, info_path = self._paths(voice_id)
+        payload = {
+            "t3": {k: _compact(v) for k, v in conds.t3.__dict__.items()},
+            "gen": {k: _compact(v) for k, v in conds.gen.items()},
+        }
+        tmp_path = tensor_path + ".tmp"
+        torch.save(payload, tmp_path)
+        os.replace(tmp_path, tensor_path)
+
+        record = dict(info)
+        record.update({
+            "voice_id": voice_id,
+            "created_at": record.get("created_at", time.time()),
+            "profile_bytes": os.path.getsize(tensor_path),
+        })
+        with open(info_path, "w") as f:
+            json.dump(record, f)
+        return record
+
+    def load(self, voice_id: str, device: str) -> Optional[Any]:
+        """Rebuild ChatterboxTTS ``Conditionals`` for a stored voice"""
+        if not self.exists(voice_id):
+            return None
+
+        import torch
+        from chatterbox.tts import Conditionals
+        from chatterbox.models.t3.modules.cond_enc import T3Cond
+
+        def _expand(value):
+            if torch.is_tensor(value) and value.dtype == torch.float16:
+                return value.float()
+            return value
+
+        payload = torch.load(self._paths(voice_id)[0], map_location="cpu", weights_only=True)
+        t3 = T3Cond(**{k: _expand(v) for k, v in payload["t3"].items()})
+        gen = {k: _expand(v) for k, v in payload["gen"].items()}
+        return Conditionals(t3, gen).to(device)
+
+    def info(self, voice_id: str) -> Optional[Dict[str, Any]]:
+        if not self.exists(voice_id):
+            return None
+        try:
+            with open(self._paths(voice_id)[1]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"voice_id": voice_id}
+
+    def list(self) -> List[Dict[str, Any]]:
+        voices = []
+        for filename in sorted(os.listdir(self.directory)):
+            voice_id, ext = os.path.splitext(filename)
+            if ext == ".pt" and self.is_valid_id(voice_id):
+                voices.append(self.info(voice_id))
+        return voices
+
+    def delete(self, voice_id: str) -> bool:
+        if not self.exists(voice_id):
+            return False
+        for path in self._paths(voice_id):
+            if os.path.exists(path):
+                os.unlink(path)
+        return True